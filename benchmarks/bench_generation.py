@@ -0,0 +1,62 @@
+"""Floor generation time and memory by map size.
+
+    python benchmarks/bench_generation.py [--sizes 40x20,100x100,250x250,500x500] [--repeat N] [--seed S]
+
+Each size is generated --repeat times with different seeds. Time is the
+median of those, memory is the peak traced by tracemalloc while building one
+floor (measured in a separate run, tracing slows python down a lot).
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from floor import Floor  # noqa: E402
+
+
+def generate(w, h, seed):
+    # a floor only needs its world once the game runs, not to be built
+    return Floor(None, w, h, f"bench:{seed}")
+
+
+def time_generation(w, h, seeds):
+    times = []
+    for seed in seeds:
+        start = time.perf_counter()
+        floor = generate(w, h, seed)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), floor
+
+
+def peak_memory(w, h, seed):
+    tracemalloc.start()
+    floor = generate(w, h, seed)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del floor
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="40x20,100x100,250x250,500x500")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'size':>10} {'ms':>9} {'peak MiB':>9} {'rooms':>6} {'open tiles':>11}")
+    for size in args.sizes.split(","):
+        w, h = (int(n) for n in size.split("x"))
+        seeds = range(args.seed, args.seed + args.repeat)
+        elapsed, floor = time_generation(w, h, seeds)
+        peak = peak_memory(w, h, args.seed)
+        rooms = len(floor.room_graph.centers)
+        print(f"{size:>10} {elapsed * 1000:>9.1f} {peak / 2**20:>9.1f} {rooms:>6} {len(floor.grid.open_tiles()):>11}")
+
+
+if __name__ == "__main__":
+    main()
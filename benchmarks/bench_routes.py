@@ -0,0 +1,75 @@
+"""How long the routes Floor.find_path plans are, next to the shortest ones.
+
+    python benchmarks/bench_routes.py [--size 150x150] [--floors 10] [--pairs 15] [--factor 1.5]
+
+find_path plans long trips through the room graph, so its routes are only
+as good as the graph's links. This walks it the way a mob does (follow the
+path, replan from where it ends) between random open tiles on seeded floors,
+and compares the steps taken with the A* distance. Any pair that takes more
+than --factor times the shortest route, or never arrives, is printed and the
+exit code is 1, run it after touching the room graph or floor generation.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from entities import astar_path  # noqa: E402
+from floor import Floor  # noqa: E402
+
+
+def walk(floor, start, goal, limit):
+    """Steps it takes to get from start to goal following find_path, None if it doesn't"""
+    pos, steps = start, 0
+    while pos != goal and steps <= limit:
+        path = floor.find_path(pos, goal)
+        if not path or len(path) < 2:
+            return None
+        pos = path[-1]
+        steps += len(path) - 1
+    return steps if pos == goal else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="150x150")
+    parser.add_argument("--floors", type=int, default=10)
+    parser.add_argument("--pairs", type=int, default=15, help="start and goal pairs per floor")
+    parser.add_argument("--factor", type=float, default=1.5, help="longest route allowed, times the shortest")
+    args = parser.parse_args()
+    w, h = map(int, args.size.split("x"))
+
+    ratios = []
+    bad = []
+    elapsed = 0
+    for i in range(args.floors):
+        seed = f"p{i}"
+        floor = Floor(None, w, h, seed)
+        rng = random.Random(seed)
+        tiles = floor.grid.open_tiles()
+        for _ in range(args.pairs):
+            start, goal = rng.sample(tiles, 2)
+            best = len(astar_path(floor, start, goal)) - 1
+            began = time.perf_counter()
+            steps = walk(floor, start, goal, 20 * best + 100)
+            elapsed += time.perf_counter() - began
+            if steps is None or steps > args.factor * best:
+                bad.append((seed, start, goal, steps, best))
+            if steps is not None:
+                ratios.append(steps / best)
+
+    print(f"{len(ratios)} routes on {args.floors} {w}x{h} floors: {statistics.mean(ratios):.2f}x the shortest"
+          f" on average, {max(ratios):.2f}x at worst, {elapsed * 1000 / (args.floors * args.pairs):.2f}ms per route")
+    for seed, start, goal, steps, best in bad:
+        taken = "never got there" if steps is None else f"{steps} steps"
+        print(f"  seed {seed!r} {start} -> {goal}: {taken}, shortest is {best}")
+    if bad:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
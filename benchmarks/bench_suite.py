@@ -0,0 +1,228 @@
+"""The hot paths one by one, on seeded fixtures, against a stored baseline.
+
+    python benchmarks/bench_suite.py [--only astar,draw] [--repeat N] [--tolerance 0.25] [--update]
+
+Every case builds its fixture from a fixed seed (same map, same mobs, same
+start and goal tiles every run) and times a fixed amount of work on it
+--repeat times, the median is what gets reported. Drawing goes to an
+offscreen surface under SDL's dummy video driver, no display needed.
+
+The numbers are compared with benchmarks/baseline.json. A case more than
+--tolerance slower than its baseline is flagged and the exit code is 1, so
+it can gate a change. Baselines only mean something on the machine that
+wrote them: run with --update before starting on a change to record your
+own, then again without it afterwards.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pygame  # noqa: E402
+
+from entities import astar_path, create_random_mob  # noqa: E402
+from floor import Floor, SLEEP_RADIUS  # noqa: E402
+from game import Game, FONTSIZE, LOG_SIZE, TOP_BAR_SIZE  # noqa: E402
+from world import World, MOVES  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+SIZES = ((40, 20), (100, 100), (250, 250))
+CROWDS = (25, 150, 600)
+# 400 fills two thirds of the open tiles around the player
+TURN_CROWDS = (25, 150, 400)
+
+
+def crowded_world(w, h, mobs, seed):
+    """World with `mobs` immortal random mobs on its first floor"""
+    world = World(w, h, seed=seed, pregenerate=False)
+    floor = world.map
+    floor.population_budget = mobs + 100
+    rng = random.Random(seed)
+    for _ in range(mobs):
+        mob = create_random_mob(rng)
+        mob.health = 10**9
+        floor.spawn("entities", mob, *floor.find_valid_spawn(floor.grid))
+    floor.flush()
+    return world
+
+
+def bench_astar(w, h):
+    floor = Floor(None, w, h, f"bench:astar:{w}x{h}")
+    rng = random.Random(1)
+    pairs = [rng.sample(floor.grid.open_tiles(), 2) for _ in range(10)]
+
+    def run():
+        for start, goal in pairs:
+            astar_path(floor, start, goal)
+    return run
+
+
+def bench_fov(w, h):
+    world = World(w, h, seed="bench:fov", pregenerate=False)
+    rng = random.Random(1)
+    spots = rng.sample(world.map.grid.open_tiles(), 50)
+    player = world.player
+
+    def run():
+        for x, y in spots:
+            player.x, player.y = x, y
+            world.calculate_fov()
+    return run
+
+
+def bench_create_floor(w, h):
+    seeds = iter(range(10**9))
+
+    def run():
+        Floor(None, w, h, f"bench:floor:{next(seeds)}")
+    return run
+
+
+def bench_move_entity(mobs):
+    world = crowded_world(100, 100, mobs, "bench:move")
+    floor = world.map
+    rng = random.Random(1)
+    moves = list(MOVES.values())
+    everyone = list(floor.components["entities"])
+
+    def run():
+        for e in everyone:
+            floor.move_entity(e, *rng.choice(moves))
+        floor.flush()
+        world.events.dispatch()
+    return run
+
+
+def bench_mob_turn(mobs):
+    """Five turns of the mobs, all of them awake around the player"""
+    world = World(100, 100, seed="bench:turn", pregenerate=False)
+    floor = world.map
+    floor.population_budget = mobs + 100
+    player = world.player
+    player.health = 10**9
+    rng = random.Random(1)
+    near = [(x, y) for x, y in floor.grid.open_tiles()
+            if (x, y) != (player.x, player.y) and abs(x - player.x) <= SLEEP_RADIUS and abs(y - player.y) <= SLEEP_RADIUS]
+    for x, y in rng.sample(near, mobs):
+        mob = create_random_mob(rng)
+        mob.health = 10**9
+        floor.spawn("entities", mob, x, y)
+    floor.flush()
+    # the mobs' dice come from the global random module
+    random.seed(1)
+
+    def run():
+        for _ in range(5):
+            # a crowd that stays awake, even the ones the player can't see
+            for e in floor.components["entities"]:
+                floor.scheduler.wake(e)
+            floor.update()
+            world.events.dispatch()
+    return run
+
+
+def bench_draw(w, h):
+    pygame.font.init()
+    font = pygame.font.SysFont("Consolas", FONTSIZE)
+    world = crowded_world(w, h, 50, "bench:draw")
+    # everything seen and in view, the most a frame can have to draw
+    everything = {(y, x) for x, y in world.map.grid.open_tiles()}
+    world.map.explored.reveal(everything, world.map.grid)
+    world.calculate_fov()
+    world.visible_tiles = everything
+    screen = pygame.Surface((w * FONTSIZE, (h + LOG_SIZE + TOP_BAR_SIZE) * FONTSIZE))
+    game = Game(world, screen, font)
+
+    def run():
+        # a full repaint, like the first frame on a floor
+        game.frame.invalidate()
+        game.dirty = True
+        game.draw()
+    return run
+
+
+def cases():
+    """name -> function building that case's fixture and returning the timed work"""
+    found = {}
+    for w, h in SIZES:
+        found[f"astar {w}x{h}"] = lambda w=w, h=h: bench_astar(w, h)
+        found[f"fov {w}x{h}"] = lambda w=w, h=h: bench_fov(w, h)
+        found[f"create_floor {w}x{h}"] = lambda w=w, h=h: bench_create_floor(w, h)
+    for mobs in CROWDS:
+        found[f"move_entity {mobs} mobs"] = lambda mobs=mobs: bench_move_entity(mobs)
+    for mobs in TURN_CROWDS:
+        found[f"mob turn {mobs} mobs"] = lambda mobs=mobs: bench_mob_turn(mobs)
+    # a 250x250 frame is a 8000px wide surface, stop at 100
+    for w, h in SIZES[:2]:
+        found[f"draw {w}x{h}"] = lambda w=w, h=h: bench_draw(w, h)
+    return found
+
+
+def measure(setup, repeat):
+    run = setup()
+    run()  # warm up caches (glyphs, flow fields) so every round does the same
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", default="", help="comma separated name prefixes, e.g. astar,draw")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="how much slower than baseline is a regression")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args()
+
+    prefixes = [p for p in args.only.split(",") if p]
+    selected = {name: setup for name, setup in cases().items() if not prefixes or name.startswith(tuple(prefixes))}
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    print(f"{'case':<24} {'ms':>9} {'baseline':>9} {'change':>8}")
+    for name, setup in selected.items():
+        ms = results[name] = measure(setup, args.repeat)
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<24} {ms:>9.2f} {'-':>9} {'':>8}")
+            continue
+        change = ms / before - 1
+        flag = ""
+        if change > args.tolerance:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif change < -args.tolerance:
+            flag = "  faster"
+        print(f"{name:<24} {ms:>9.2f} {before:>9.2f} {change:>+8.0%}{flag}")
+
+    if args.update:
+        # keep the cases that weren't run this time
+        baseline.update({name: round(ms, 3) for name, ms in results.items()})
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Turns per second of the headless World, floor by floor.
+
+    python benchmarks/bench_turns.py [--turns N] [--depths 0,2,5,10] [--seed S]
+
+The player is made unkillable and walks around at random, so every run plays
+the same number of real turns on each depth.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from world import World, MOVES  # noqa: E402
+
+
+def world_at_depth(depth):
+    world = World()
+    for _ in range(depth):
+        world.map.place(world.player, *world.map.find_down_stairs(world.map.grid))
+        world.go_down_stairs()
+    world.player.max_health = world.player.health = 10**9
+    return world
+
+
+def turns_per_second(depth, turns):
+    world = world_at_depth(depth)
+    moves = list(MOVES)
+    start = time.perf_counter()
+    for _ in range(turns):
+        world.step(random.choice(moves))
+    elapsed = time.perf_counter() - start
+    return turns / elapsed, len(world.map.components["entities"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--depths", default="0,2,5,10")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'depth':>5} {'turns/s':>10} {'entities':>9}")
+    for depth in [int(d) for d in args.depths.split(",")]:
+        random.seed(args.seed)
+        rate, entities = turns_per_second(depth, args.turns)
+        print(f"{depth:>5} {rate:>10.0f} {entities:>9}")
+
+
+if __name__ == "__main__":
+    main()
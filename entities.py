@@ -1,5 +1,6 @@
 import random
 import heapq
+from collections import deque
 
 class Item:
     def __init__(self, name, value, symbol):
@@ -19,7 +20,12 @@ class Weapon(Item):
 
 
 class Entity:
-    def __init__(self, name, x, y, health, strength, symbol, color, weapon=None, ai=None):
+    __slots__ = (
+        "original", "inventory", "weapon", "strength", "name", "x", "y", "max_health", "health", "symbol",
+        "level", "experience_to_level", "experience", "dead", "ai", "ex_gain", "score", "color", "speed",
+    )
+
+    def __init__(self, name, x, y, health, strength, symbol, color, weapon=None, ai=None, speed=100):
         self.original = True
 
         self.inventory = []
@@ -42,6 +48,8 @@ class Entity:
         self.ex_gain = 10  # experience given when killed
         self.score = 0
         self.color = color
+        # 100 acts once per player turn, 200 twice, 50 every other turn (see Scheduler)
+        self.speed = speed
         if self.ai:
             self.ai.owner = self
 
@@ -74,8 +82,8 @@ class Ai:
 
 # prolly want to make this more generic in the future??
 # maybe add it to the world class?
-def create_random_mob():
-    mob_type = random.choice(["orc", "snake", "rat", "amoeba"])
+def create_random_mob(rng=random):
+    mob_type = rng.choice(["orc", "snake", "rat", "amoeba"])
     return create_mob(mob_type)
 
 
@@ -105,9 +113,13 @@ def create_mob(name):
 # ----------------- AI Implementations ---------------- #
 
 
+# the four ways a mob can wonder
+STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
 class WonderAi(Ai):
     def take_turn(self, floor):
-        x, y = random.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+        x, y = random.choice(STEPS)
         floor.move_entity(self.owner, x, y)
 
 
@@ -120,16 +132,42 @@ class ChaseAi(Ai):
 
 
 class AStarAi(Ai):
+    def __init__(self, owner):
+        super().__init__(owner)
+        self.path = None
+
     def take_turn(self, floor):
-        player = floor.world.player
-        start = (self.owner.x, self.owner.y)
-        goal = (player.x, player.y)
-        path = astar_path(floor, start, goal)
-        if path and len(path) > 1:
-            next_step = path[1]
-            x = next_step[0] - self.owner.x
-            y = next_step[1] - self.owner.y
-            floor.move_entity(self.owner, x, y)
+        x, y = self.owner.x, self.owner.y
+        flow = floor.player_flow()
+        if flow.distance(x, y) >= 0:
+            # every mob near the player shares the floor's flow field, so this
+            # is a lookup instead of a search of its own
+            self.path = None
+            step = flow.step_toward(x, y)
+        else:
+            # out of the flow field's reach, walk a path planned through the room graph
+            step = self.follow_path(floor)
+        if step:
+            floor.move_entity(self.owner, *step)
+
+    def follow_path(self, floor):
+        x, y = self.owner.x, self.owner.y
+        # kept reversed with the tile we're on at the end, the last step only
+        # comes off once it was taken. a step that bumped into someone is
+        # tried again, planning anew would only find the same path (find_path
+        # doesn't see mobs) and costs an A* per blocked mob per turn in a crowd
+        if self.path and len(self.path) > 1 and self.path[-2] == (x, y):
+            self.path.pop()
+        # replan once the path is used up or we got knocked off it
+        if not self.path or len(self.path) < 2 or self.path[-1] != (x, y):
+            player = floor.world.player
+            path = floor.find_path((x, y), (player.x, player.y))
+            if not path or len(path) < 2:
+                self.path = None
+                return None
+            self.path = path[::-1]
+        nx, ny = self.path[-2]
+        return (nx - x, ny - y)
 
 
 class ChaseAndWonderAi(Ai):
@@ -142,30 +180,284 @@ class ChaseAndWonderAi(Ai):
             floor.move_entity(self.owner, x, y)
         else:
             # wonder
-            x, y = random.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+            x, y = random.choice(STEPS)
             floor.move_entity(self.owner, x, y)
 
 class RunAndWonderAi(Ai):
     def take_turn(self, floor):
         if random.random() < 0.5:
-            # run
-            player = floor.world.player
-            x = ( 0 if player.x == self.owner.x else (1 if player.x < self.owner.x else -1) )
-            y = ( 0 if player.y == self.owner.y else (1 if player.y < self.owner.y else -1) )
-            floor.move_entity(self.owner, x, y)
+            # run, to whichever neighbour has the longest walk to the player
+            step = floor.player_flow().step_away(self.owner.x, self.owner.y)
+            if step:
+                floor.move_entity(self.owner, *step)
         else:
             # wonder
-            x, y = random.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+            x, y = random.choice(STEPS)
             floor.move_entity(self.owner, x, y)
 
+# ----------------- Snapshots ---------------- #
+
+
+AI_TYPES = {cls.__name__: cls for cls in (WonderAi, ChaseAi, AStarAi, ChaseAndWonderAi, RunAndWonderAi)}
+
+# everything about an entity that can change or differ between mobs
+ENTITY_FIELDS = (
+    "name", "x", "y", "max_health", "health", "strength", "symbol", "color", "level",
+    "experience_to_level", "experience", "dead", "ex_gain", "score", "original", "speed",
+)
+
+
+def pack_entity(e):
+    """Entity as a plain tuple, AI by class name and weapon as its fields"""
+    weapon = e.weapon
+    if weapon:
+        weapon = (weapon.name, weapon.value, weapon.symbol, weapon.min_damage, weapon.max_damage)
+    ai = type(e.ai).__name__ if e.ai else None
+    return tuple(getattr(e, f) for f in ENTITY_FIELDS) + (weapon, ai)
+
+
+def unpack_entity(state):
+    """Rebuilds a pack_entity tuple, with a fresh AI owned by the new entity"""
+    *fields, weapon, ai = state
+    values = dict(zip(ENTITY_FIELDS, fields))
+    if weapon:
+        weapon = Weapon(*weapon)
+    ai = AI_TYPES[ai](None) if ai else None
+    e = Entity(values["name"], values["x"], values["y"], values["max_health"], values["strength"], values["symbol"], values["color"], weapon, ai)
+    for f, value in values.items():
+        setattr(e, f, value)
+    return e
+
+
 # ----------------- Pathfinding ---------------- #
 
 
+class FlowField:
+    """Walking distance from every tile to one goal tile.
+
+    All steps cost the same so the Dijkstra map is a plain BFS out from the
+    goal, stopping after max_distance steps if given. Any number of mobs can
+    then read their next step toward (or away from) the goal in O(1). Like
+    astar_path, only walls block, not entities.
+    """
+
+    directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
+    def __init__(self, floor, goal_x, goal_y, max_distance=None):
+        grid = floor.grid
+        self.width = width = grid.width
+        self.height = height = grid.height
+        self.dist = dist = [-1] * (width * height)
+
+        start = goal_y * width + goal_x
+        dist[start] = 0
+        queue = deque([start])
+        while queue:
+            i = queue.popleft()
+            d = dist[i] + 1
+            if max_distance is not None and d > max_distance:
+                break
+            x, y = i % width, i // width
+            for dx, dy in self.directions:
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < width and 0 <= ny < height:
+                    n = ny * width + nx
+                    if dist[n] < 0 and grid.passable(nx, ny):
+                        dist[n] = d
+                        queue.append(n)
+
+    def distance(self, x, y):
+        """Steps to the goal, -1 when it can't be reached"""
+        return self.dist[y * self.width + x]
+
+    def step_toward(self, x, y):
+        """(dx, dy) of a step that gets one closer to the goal, None if there is none"""
+        d = self.distance(x, y)
+        if d <= 0:
+            return None
+        for dx, dy in self.directions:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < self.width and 0 <= ny < self.height and self.distance(nx, ny) == d - 1:
+                return (dx, dy)
+        return None
+
+    def step_away(self, x, y):
+        """(dx, dy) of the neighbour furthest from the goal, None if nothing is further"""
+        best, best_d = None, self.distance(x, y)
+        if best_d < 0:
+            return None
+        for dx, dy in self.directions:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < self.width and 0 <= ny < self.height and self.distance(nx, ny) > best_d:
+                best, best_d = (dx, dy), self.distance(nx, ny)
+        return best
+
+
+class RoomGraph:
+    """Rooms and the corridors joining them, recorded while a floor is carved.
+
+    Rooms are the nodes. Two rooms are linked when a corridor runs from one to
+    the other without passing through a third, when they overlap, or when
+    corridors cross or run alongside each other or a room (link_adjacent,
+    once everything is carved). Routes between rooms are cached until the
+    floor's layout version changes.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.centers = []
+        self.room_of = [-1] * (width * height)  # first room covering each tile
+        self.corridor_of = {}  # corridor tile -> the two rooms at its ends
+        self.links = {}  # room -> {linked room: cost}
+        self.trees = {}  # room -> (cost, previous room) from a Dijkstra out of it
+        self.version = 0
+
+    def add_room(self, x, y, w, h):
+        room = len(self.centers)
+        self.centers.append((x + w // 2, y + h // 2))
+        self.links[room] = {}
+        for yy in range(y, y + h):
+            for xx in range(x, x + w):
+                i = yy * self.width + xx
+                if self.room_of[i] < 0:
+                    self.room_of[i] = room
+                else:
+                    self.link(self.room_of[i], room)
+
+    def add_corridor(self, a, b, tiles):
+        """tiles in walking order from room a to room b"""
+        last, pending = a, []
+        for x, y in tiles:
+            i = y * self.width + x
+            room = self.room_of[i]
+            if room < 0:
+                pending.append((x, y))
+            elif room != last:
+                self.link(last, room)
+                self.add_segment(last, room, pending)
+                last, pending = room, []
+        self.add_segment(last, b, pending)
+
+    def add_segment(self, a, b, tiles):
+        for x, y in tiles:
+            i = y * self.width + x
+            crossed = self.corridor_of.setdefault(i, (a, b))
+            # corridors crossing each other join the rooms at all four ends
+            for c in crossed:
+                for d in (a, b):
+                    if c != d:
+                        self.link(c, d, (x, y))
+
+    def link_adjacent(self):
+        """Links rooms whose corridors touch a room or another corridor side by side.
+
+        Those join up on the map without sharing a tile, so add_corridor can't
+        see them. One pass over the corridor tiles, after all of them are in.
+        """
+        w = self.width
+        room_of = self.room_of
+        corridor_of = self.corridor_of
+        for i, ends in corridor_of.items():
+            for j in (i - 1, i + 1, i - w, i + w):
+                others = corridor_of.get(j)
+                if others is None:
+                    room = room_of[j] if 0 <= j < len(room_of) else -1
+                    if room < 0 or room in ends:
+                        continue
+                    others = (room,)
+                elif others == ends:
+                    # the rest of the same corridor, nearly always
+                    continue
+                via = (i % w, i // w)
+                for c in others:
+                    for d in ends:
+                        if c != d:
+                            self.link(c, d, via)
+
+    def link(self, a, b, via=None):
+        if via is None:
+            cost = heuristic(self.centers[a], self.centers[b])
+        else:
+            cost = heuristic(self.centers[a], via) + heuristic(via, self.centers[b])
+        if cost < self.links[a].get(b, float("inf")):
+            self.links[a][b] = cost
+            self.links[b][a] = cost
+
+    def rooms_at(self, x, y):
+        i = y * self.width + x
+        if self.room_of[i] >= 0:
+            return (self.room_of[i],)
+        return self.corridor_of.get(i, ())
+
+    def tree(self, source):
+        tree = self.trees.get(source)
+        if tree is None:
+            cost, prev = {source: 0}, {source: None}
+            open_set = [(0, source)]
+            while open_set:
+                c, room = heapq.heappop(open_set)
+                if c > cost[room]:
+                    continue
+                for other, step in self.links[room].items():
+                    if c + step < cost.get(other, float("inf")):
+                        cost[other] = c + step
+                        prev[other] = room
+                        heapq.heappush(open_set, (c + step, other))
+            tree = self.trees[source] = (cost, prev)
+        return tree
+
+    def waypoint(self, start, goal, version, reach):
+        """Tile to head for on the way from start to goal, None if either is off the graph.
+
+        That is the center of the furthest room along the route that is still
+        within `reach` steps (as the crow walks) of start, or the goal itself.
+        """
+        if version != self.version:
+            self.trees = {}
+            self.version = version
+
+        best = None
+        for s in self.rooms_at(*start):
+            cost, prev = self.tree(s)
+            for g in self.rooms_at(*goal):
+                if g in cost:
+                    total = heuristic(start, self.centers[s]) + cost[g] + heuristic(self.centers[g], goal)
+                    if best is None or total < best[0]:
+                        best = (total, s, g, prev)
+        if best is None:
+            return None
+
+        _, s, g, prev = best
+        route = [g]
+        while route[-1] != s:
+            route.append(prev[route[-1]])
+        route.reverse()
+        if self.room_of[start[1] * self.width + start[0]] == s:
+            # already in the first room of the route
+            route.pop(0)
+        target = None
+        for room in route:
+            center = self.centers[room]
+            # overlapping rooms can put the next center right where we stand
+            if center == start:
+                continue
+            if target is not None and heuristic(start, center) > reach:
+                break
+            target = center
+        else:
+            if target is None or heuristic(start, goal) <= reach:
+                target = goal
+        return target
+
+
 def heuristic(a, b):
     return abs(a[0] - b[0]) + abs(a[1] - b[1])
 
 
-def astar_path(world, start, goal):
+def astar_path(world, start, goal, max_nodes=None, stats=None):
+    """Shortest path from start to goal as a list of tiles, None if there is none
+    (or max_nodes were expanded first). Adds the nodes it expanded to
+    stats["astar nodes"] if given, see profiler.py"""
     height = len(world.grid)
     width = len(world.grid[0])
 
@@ -190,10 +482,18 @@ def astar_path(world, start, goal):
 
     came_from = {start: None}
     g_score = {start: 0}
+    expanded = 0
 
     while open_set:
         _, current = heapq.heappop(open_set)
 
+        # give up instead of flooding the whole map looking for something far away
+        expanded += 1
+        if max_nodes is not None and expanded > max_nodes:
+            if stats is not None:
+                stats["astar nodes"] += expanded
+            return None
+
         if current == goal:
             # reconstruct path
             path = []
@@ -201,6 +501,8 @@ def astar_path(world, start, goal):
                 path.append(current)
                 current = came_from[current]
             path.reverse()
+            if stats is not None:
+                stats["astar nodes"] += expanded
             return path
 
         for dx, dy in directions:
@@ -215,4 +517,6 @@ def astar_path(world, start, goal):
                 f_score = tentative_g + heuristic(neighbor, goal)
                 heapq.heappush(open_set, (f_score, neighbor))
 
+    if stats is not None:
+        stats["astar nodes"] += expanded
     return None
@@ -0,0 +1,139 @@
+"""What happened during a turn, as typed events instead of log strings.
+
+Floors and systems emit events (an attack, a death, a level up...) onto the
+world's EventBus as they happen. They are queued for the turn and handed to
+every subscriber once it is over, see World.update. World subscribes the
+message log and the damage stats, anything else (achievements, analytics, a
+bot) can subscribe the same way:
+
+    world.events.subscribe(Death, lambda event: kills.append(event.entity.name))
+
+An event only becomes text when str() is called on it, which the message log
+leaves to whoever shows it. Most messages never are, and headless runs never
+show any.
+"""
+from collections import defaultdict
+
+
+class Event:
+    __slots__ = ()
+
+    def text(self):
+        raise NotImplementedError
+
+    def __str__(self):
+        return self.text()
+
+
+class Attack(Event):
+    __slots__ = ("attacker", "target", "damage")
+
+    def __init__(self, attacker, target, damage):
+        self.attacker = attacker
+        self.target = target
+        self.damage = damage
+
+    @property
+    def source(self):
+        return self.attacker.name
+
+    def text(self):
+        return f"{self.attacker.name} attacks {self.target.name} for {self.damage}!"
+
+
+class ArrowHit(Event):
+    __slots__ = ("target", "damage")
+
+    source = "arrow trap"
+
+    def __init__(self, target, damage):
+        self.target = target
+        self.damage = damage
+
+    def text(self):
+        return f"{self.target.name} got hit by an arrow for {self.damage} damage!"
+
+
+class Death(Event):
+    __slots__ = ("entity",)
+
+    def __init__(self, entity):
+        self.entity = entity
+
+    def text(self):
+        return f"{self.entity.name} dies!"
+
+
+class ExperienceGained(Event):
+    __slots__ = ("entity", "amount")
+
+    def __init__(self, entity, amount):
+        self.entity = entity
+        self.amount = amount
+
+    def text(self):
+        return f"{self.entity.name} gains {self.amount} experience!"
+
+
+class LevelUp(Event):
+    __slots__ = ("entity", "level")
+
+    def __init__(self, entity, level):
+        self.entity = entity
+        self.level = level
+
+    def text(self):
+        return f"{self.entity.name} levels up to level {self.level}!"
+
+
+class Replicated(Event):
+    __slots__ = ("parent", "child")
+
+    def __init__(self, parent, child):
+        self.parent = parent
+        self.child = child
+
+    def text(self):
+        return f"{self.parent.name} has replicated"
+
+
+class PotionUsed(Event):
+    __slots__ = ("entity", "amount")
+
+    def __init__(self, entity, amount):
+        self.entity = entity
+        self.amount = amount
+
+    def text(self):
+        return f"{self.entity.name} gained {self.amount} health from potion"
+
+
+class EventBus:
+    """Per turn event queue. Subscribe to an event class, or to Event for all of them"""
+
+    def __init__(self):
+        self.queue = []
+        self.subscribers = defaultdict(list)
+
+    def subscribe(self, kind, handler):
+        self.subscribers[kind].append(handler)
+
+    def emit(self, event):
+        self.queue.append(event)
+
+    def clear(self):
+        self.queue = []
+
+    def dispatch(self):
+        """Hands this turn's events to the subscribers, in the order they happened"""
+        subscribers = self.subscribers
+        everything = subscribers.get(Event, ())
+        # anything a handler emits goes out in the same dispatch
+        while self.queue:
+            queue = self.queue
+            self.queue = []
+            for event in queue:
+                for handler in subscribers.get(type(event), ()):
+                    handler(event)
+                for handler in everything:
+                    handler(event)
@@ -1,5 +1,142 @@
+import heapq
+import math
 import random
-from entities import Entity, WonderAi
+import zlib
+from collections import deque
+from events import Attack, ArrowHit, Death, ExperienceGained, LevelUp, Replicated, PotionUsed
+from entities import Entity, WonderAi, STEPS, FlowField, RoomGraph, astar_path, heuristic, create_random_mob, pack_entity, unpack_entity
+from fov import ExploredMap
+from tiles import TileGrid
+
+class FreeTiles:
+    """Every open floor tile with nothing on it, for picking spawn spots.
+
+    Kept as a list plus a tile -> slot dict, so taking a tile out swaps the
+    last one into its slot and a uniformly random free tile is one
+    `rng.choice`. The floor's SpatialIndexes report what stands where.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.tiles = grid.open_tiles()
+        self.slot = {pos: i for i, pos in enumerate(self.tiles)}
+        self.count = {}  # tile -> how many objects stand on it
+
+    def take(self, pos):
+        i = self.slot.pop(pos, None)
+        if i is None:
+            return
+        last = self.tiles.pop()
+        if last != pos:
+            self.tiles[i] = last
+            self.slot[last] = i
+
+    def put(self, pos):
+        if pos not in self.slot and self.grid.tile(*pos) == "." and not self.count.get(pos):
+            self.slot[pos] = len(self.tiles)
+            self.tiles.append(pos)
+
+    def occupy(self, pos):
+        self.count[pos] = self.count.get(pos, 0) + 1
+        self.take(pos)
+
+    def release(self, pos):
+        n = self.count[pos] - 1
+        if n:
+            self.count[pos] = n
+        else:
+            del self.count[pos]
+            self.put(pos)
+
+    def is_free(self, x, y):
+        return (x, y) in self.slot
+
+    def sample(self, rng):
+        return rng.choice(self.tiles) if self.tiles else None
+
+
+class SpatialIndex:
+    """Objects filed by the tile they stand on, so "what is at (x, y)" is a dict lookup.
+
+    Floor keeps one per component type and updates it whenever something
+    spawns, moves or is removed. Occupied tiles are taken out of the floor's
+    FreeTiles as they fill up and put back when they empty.
+    """
+
+    def __init__(self, free=None):
+        self.cells = {}  # (x, y) -> objects on that tile
+        self.where = {}  # object -> (x, y) it is filed under
+        self.free = free
+
+    def add(self, obj):
+        pos = (obj.x, obj.y)
+        self.cells.setdefault(pos, []).append(obj)
+        self.where[obj] = pos
+        if self.free:
+            self.free.occupy(pos)
+
+    def remove(self, obj):
+        pos = self.where.pop(obj, None)
+        if pos is None:
+            return
+        cell = self.cells[pos]
+        cell.remove(obj)
+        if not cell:
+            del self.cells[pos]
+        if self.free:
+            self.free.release(pos)
+
+    def update(self, obj):
+        if self.where.get(obj) != (obj.x, obj.y):
+            self.remove(obj)
+            self.add(obj)
+
+    def at(self, x, y):
+        return self.cells.get((x, y), ())
+
+
+class ComponentSet:
+    """Insertion ordered set of the objects of one component type.
+
+    Iterates and appends like the lists it replaces, but removing something is
+    O(1). It must not change while a system is looping over it, systems queue
+    spawns and removals on the floor's CommandBuffer instead.
+    """
+
+    def __init__(self, objs=()):
+        self.objs = dict.fromkeys(objs)
+
+    def append(self, obj):
+        self.objs[obj] = None
+
+    def remove(self, obj):
+        self.objs.pop(obj, None)
+
+    def __contains__(self, obj):
+        return obj in self.objs
+
+    def __iter__(self):
+        return iter(self.objs)
+
+    def __len__(self):
+        return len(self.objs)
+
+
+class CommandBuffer:
+    """Spawns and removals queued during a system pass, applied after it (Floor.flush)"""
+
+    def __init__(self):
+        self.spawns = []  # (kind, obj, x, y)
+        self.despawns = []  # (kind, obj)
+        self.pending = 0  # entities queued to spawn, counted against the budget
+        self.reserved = set()  # tiles an entity is queued to spawn on
+
+    def clear(self):
+        self.spawns = []
+        self.despawns = []
+        self.pending = 0
+        self.reserved = set()
+
 
 class System:
     def __init__(self):
@@ -24,44 +161,126 @@ class Potion:
             entity.health = entity.max_health
 
         self.used = True
-        world.log_message(f"{entity.name} gained 20 health from potion")
+        world.events.emit(PotionUsed(entity, 20))
 
 
 class PostionSystem(System):
     def run(self, floor):
         for i in floor.components["potion"]:
-            for entity in floor.components["entities"]:
-                if not i.used and i.x == entity.x and i.y == entity.y:
+            if not i.used:
+                for entity in floor.index["entities"].at(i.x, i.y):
                     i.activate(entity, floor.world)
+                    break
+
+
+
+class Scheduler:
+    """Turn order for the mobs near the player, by energy.
 
+    A mob with speed s gains s energy per player turn and acts for every 100
+    it has, kept here as the time it acts next in a heap so a turn only pops
+    whoever is due. Mobs start dormant and only join once they come within
+    WAKE_RADIUS of the player, are seen, or get hurt. Awake mobs that wander
+    off past SLEEP_RADIUS go dormant again. Dormant mobs cost nothing.
+    """
+
+    TURN = 100  # time that passes per player turn
+
+    def __init__(self):
+        self.now = 0
+        self.queue = []  # (time, order, entity)
+        self.order = 0  # ties on time go to whoever woke first
+        self.awake = set()
+
+    def wake(self, e):
+        if e.ai and e not in self.awake and not e.dead:
+            self.awake.add(e)
+            self.order += 1
+            heapq.heappush(self.queue, (self.now + self.delay(e), self.order, e))
+
+    def restore(self, now, order, queue):
+        self.now = now
+        self.order = order
+        self.queue = queue
+        heapq.heapify(queue)
+        self.awake = {e for _, _, e in queue}
+
+    def delay(self, e):
+        return self.TURN * 100 // max(e.speed, 1)
+
+    def wake_near(self, floor, x, y):
+        """Wakes everything within WAKE_RADIUS of (x, y) or in the player's sight"""
+        r = WAKE_RADIUS
+        cells = floor.index["entities"].cells
+        if len(cells) < (2 * r + 1) ** 2:
+            for (cx, cy), objs in cells.items():
+                if abs(cx - x) <= r and abs(cy - y) <= r:
+                    for e in objs:
+                        self.wake(e)
+        else:
+            for cy in range(y - r, y + r + 1):
+                for cx in range(x - r, x + r + 1):
+                    for e in cells.get((cx, cy), ()):
+                        self.wake(e)
+        for cy, cx in floor.world.visible_tiles:
+            for e in cells.get((cx, cy), ()):
+                self.wake(e)
+
+    def due(self, floor, x, y):
+        """Advances one player turn, returns the mobs that act in it in order"""
+        self.now += self.TURN
+        queue = self.queue
+        entities = floor.components["entities"]
+        actors = []
+        while queue and queue[0][0] <= self.now:
+            time, order, e = heapq.heappop(queue)
+            if e.dead or e not in entities:
+                self.awake.discard(e)
+                continue
+            if abs(e.x - x) > SLEEP_RADIUS or abs(e.y - y) > SLEEP_RADIUS:
+                self.awake.discard(e)
+                continue
+            actors.append(e)
+            heapq.heappush(queue, (time + self.delay(e), order, e))
+        return actors
+
+
+# how close (in tiles, either axis) the player has to get to wake a mob, and
+# how far an awake one has to get to doze off again
+WAKE_RADIUS = 12
+SLEEP_RADIUS = 24
 
 
 class EntitySystem(System):
     def run(self, floor):
-        for e in floor.components["entities"]:
-            if e.ai and not e.dead:
+        player = floor.world.player
+        floor.world.calculate_fov()
+        floor.scheduler.wake_near(floor, player.x, player.y)
+        actors = floor.scheduler.due(floor, player.x, player.y)
+
+        for e in actors:
+            if not e.dead:
                 if e.name == "amoeba":
                     if random.random() > 0.03:
                         e.ai.take_turn(floor)
                     else:
-                        directions = [ (1, 0), (-1, 0), (0, 1), (0, -1), ]
-                        open_tiles = [dir for dir in directions if floor.grid[e.y + dir[0]][e.x + dir[1]] == "."]
-                        if open_tiles:
-                            mob = Entity("amoeba", 0, 0, 3, 1, "a", (55, 120, 50), ai=WonderAi(None))
-                            floor.add_component("entities", mob)
-                            open_tile = random.choice(open_tiles)
-                            mob.original = False
-                            mob.x = e.x + open_tile[1]
-                            mob.y = e.y + open_tile[0]
-                            floor.world.log_message("amoeba has replicated")
+                        self.replicate(floor, e)
                 else:
                     e.ai.take_turn(floor)
 
-        floor.components["entities"] = [ e for e in floor.components["entities"] if not e.dead and e.health > 0 ]
+    def replicate(self, floor, e):
+        directions = [ (1, 0), (-1, 0), (0, 1), (0, -1), ]
+        open_tiles = [dir for dir in directions if floor.free.is_free(e.x + dir[1], e.y + dir[0])]
+        if open_tiles:
+            mob = Entity("amoeba", 0, 0, 3, 1, "a", (55, 120, 50), ai=WonderAi(None))
+            open_tile = random.choice(open_tiles)
+            mob.original = False
+            if floor.spawn("entities", mob, e.x + open_tile[1], e.y + open_tile[0]):
+                floor.world.events.emit(Replicated(e, mob))
 
 
 class ArrowTrap:
-    def __init__(self, symbol, x, y, color, lifetime):
+    def __init__(self, symbol, x, y, color, lifetime, rng=random, direction=None):
         self.name = "arrow trap"
         self.symbol = symbol
         self.x = x
@@ -69,7 +288,8 @@ class ArrowTrap:
         self.visable = True
         self.color = color
         self.lifetime = lifetime
-        self.direction = random.choice(["up","down","left","right"])
+        # a restored arrow keeps its direction, only new ones roll for it
+        self.direction = direction or rng.choice(["up","down","left","right"])
 
     def tick(self):
         self.lifetime -= 1
@@ -91,27 +311,104 @@ class ArrowTrapSystem(System):
 
             e.tick()
 
-        arrow_tiles = [(tile.x, tile.y) for tile in floor.components["arrowtrap"]]
-        for e in floor.components["entities"]:
-            if not e.dead:
-                if (e.x, e.y) in arrow_tiles:
+        # two arrows on one tile still only hit once
+        for x, y in floor.index["arrowtrap"].cells:
+            for e in floor.index["entities"].at(x, y):
+                if not e.dead:
                     e.health -= 10
-                    floor.world.log_message( f"{e.name} got hit by an arrow for {10} damage!" )
-        
-        for e in floor.components["potion"]:
-            if not e.used:
-                if (e.x, e.y) in arrow_tiles:
+                    floor.scheduler.wake(e)
+                    floor.world.events.emit(ArrowHit(e, 10))
+                    if e.health <= 0:
+                        floor.despawn("entities", e)
+
+            for e in floor.index["potion"].at(x, y):
+                if not e.used:
                     e.used =  True
 
-        floor.components["arrowtrap"] = [ e for e in floor.components["arrowtrap"] if e.lifetime > 0 ]
+        for e in floor.components["arrowtrap"]:
+            if e.lifetime <= 0:
+                floor.despawn("arrowtrap", e)
+
+
+class EvictedFloor:
+    """A floor nobody is on, boiled down to its seed and what changed since.
+
+    The layout comes back from the seed. Mobs, potions and arrows are kept as
+    they are (a handful of tuples), the explored map compressed.
+    """
+
+    def __init__(self, seed, entities, potions, arrows, seen, walls, left_turn):
+        self.seed = seed
+        self.entities = entities  # pack_entity tuples, None where the player goes
+        self.potions = potions
+        self.arrows = arrows
+        self.seen = seen
+        self.walls = walls
+        self.left_turn = left_turn
+
+    @classmethod
+    def of(cls, floor, player):
+        return cls(
+            floor.seed,
+            [None if e is player else pack_entity(e) for e in floor.components["entities"]],
+            [(p.x, p.y, p.used) for p in floor.components.get("potion", [])],
+            [(a.x, a.y, a.lifetime, a.direction) for a in floor.components.get("arrowtrap", [])],
+            zlib.compress(bytes(floor.explored.seen)),
+            zlib.compress(bytes(floor.explored.walls)),
+            floor.left_turn,
+        )
+
+    def rebuild(self, world, grid_w, grid_h):
+        floor = Floor(world, grid_w, grid_h, self.seed)
+        floor.restore(self, world.player)
+        floor.left_turn = self.left_turn
+        return floor
+
+
+# floors the player is away from aren't played turn by turn, see Floor.catch_up.
+# however long the player was gone a mob wanders at most this many steps
+CATCH_UP_STEPS = 40
+AMOEBA_SPLIT = 0.03  # chance an amoeba replicates on its turn, as in EntitySystem
+
+# most entities a floor holds before spawns are refused (or the oldest
+# replicas make room, see Floor.over_budget). keeps amoeba floors from
+# growing without bound and so bounds the cost of a turn
+POPULATION_BUDGET = 150
 
 
 class Floor:
-    def __init__(self, world, grid_w, grid_h):
+    def __init__(self, world, grid_w, grid_h, seed=None):
+        # everything generated for this floor comes from its own rng, so the
+        # same seed always rebuilds the same floor (see EvictedFloor)
+        self.seed = seed
+        self.rng = random.Random(seed)
         self.grid = self.create_floor(grid_w, grid_h)
+        # bumped whenever a tile changes between blocking and open, anything
+        # cached from the layout (fov...) checks it
+        self.version = 0
+        # what the player has seen here, kept with the floor across stair trips
+        self.explored = ExploredMap(grid_w, grid_h)
+        # distance map to the player, rebuilt at most once per player move.
+        # it only spreads flow_radius steps out, mobs further away than that
+        # path through the room graph instead (see find_path)
+        self.flow = None
+        self.flow_key = None
+        self.flow_radius = 40
 
         self.world = world
-        self.components = {"entities": []}
+        self.components = {"entities": ComponentSet()}
+        # same keys as components, see SpatialIndex
+        self.free = FreeTiles(self.grid)
+        self.index = {"entities": SpatialIndex(self.free)}
+        self.commands = CommandBuffer()
+        self.scheduler = Scheduler()
+        self.population_budget = POPULATION_BUDGET
+        # "refuse" drops spawns past the budget, "evict" removes the oldest
+        # replica to make room for the new one
+        self.over_budget = "refuse"
+        self.replicas = deque()  # entities spawned during play, oldest first (only kept for "evict")
+        # world turn the player last left this floor on, None while they are on it
+        self.left_turn = None
 
         self.systems = [EntitySystem(), ArrowTrapSystem(), PostionSystem()]
 
@@ -120,56 +417,191 @@ class Floor:
             self.add_component("potion", Potion(0, 0, "Potion", "P", (140, 255, 200)))
 
         for _ in range(3):
-            self.add_component("arrowtrap", ArrowTrap("*", 0, 0, (123,123,123), 30))
+            self.add_component("arrowtrap", ArrowTrap("*", 0, 0, (123,123,123), 30, self.rng))
+
+    def refresh_free(self):
+        """Rebuilds FreeTiles from the grid and whatever stands on it"""
+        self.free = FreeTiles(self.grid)
+        for index in self.index.values():
+            index.free = self.free
+            for pos in index.where.values():
+                self.free.occupy(pos)
+
+    def populate(self, depth):
+        """Spawns the starting mobs, deeper floors get more of them and tougher ones"""
+        if depth == 0:
+            for _ in range(3):
+                self.add_component("entities", create_random_mob(self.rng))
+            return
+
+        above = depth - 1
+        for _ in range(self.rng.randint(1, above + 4)):
+            mob = create_random_mob(self.rng)
+            for _ in range(self.rng.randint(above, above + 3)):
+                mob.level_up()
+            mob.set_ex(mob.ex_gain + above * 2)
+            self.add_component("entities", mob)
+
+    def restore(self, evicted, player):
+        """Swaps the generated mobs, potions and traps for the ones an EvictedFloor kept"""
+        self.components = {"entities": ComponentSet(), "potion": ComponentSet(), "arrowtrap": ComponentSet()}
+        self.free = FreeTiles(self.grid)
+        self.index = {kind: SpatialIndex(self.free) for kind in self.components}
+
+        def put(kind, obj):
+            self.components[kind].append(obj)
+            self.index[kind].add(obj)
+
+        for state in evicted.entities:
+            put("entities", player if state is None else unpack_entity(state))
+        for x, y, used in evicted.potions:
+            potion = Potion(x, y, "Potion", "P", (140, 255, 200))
+            potion.used = used
+            put("potion", potion)
+        for x, y, lifetime, direction in evicted.arrows:
+            arrow = ArrowTrap("*", x, y, (123,123,123), lifetime, direction=direction)
+            put("arrowtrap", arrow)
+
+        self.explored.seen[:] = zlib.decompress(evicted.seen)
+        self.explored.walls[:] = zlib.decompress(evicted.walls)
+
+    def catch_up(self, turns):
+        """Fast forwards the floor by `turns` turns the player was away for.
+
+        A coarse model instead of playing every turn. Like in live play only
+        the mobs that were awake when the player left do anything, those are
+        the ones the scheduler had awake and the ones near the stairs the
+        player took: they take a short random walk over free tiles without
+        fighting, and every awake amoeba replicates at its usual rate onto the
+        free tiles next to it (the replicas don't split again, in live play
+        the crowd stays small by getting in its own way). Arrows lose the
+        lifetime they would have flown for.
+        """
+        if turns <= 0:
+            return
+        steps = min(turns, CATCH_UP_STEPS)
+        awake = [e for e in self.components["entities"] if e.ai and not e.dead and (e in self.scheduler.awake or self.near_stairs(e))]
+        for e in awake:
+            self.place(e, *self.wander(e.x, e.y, steps))
+
+        free = self.free
+        keep = math.log(1 - AMOEBA_SPLIT)
+        for parent in [e for e in awake if e.name == "amoeba"]:
+            turn = 0
+            while True:
+                # turns until its next split
+                turn += 1 + int(math.log(1.0 - random.random()) / keep)
+                sides = [(parent.x + dx, parent.y + dy) for dx, dy in STEPS if free.is_free(parent.x + dx, parent.y + dy)]
+                if turn > turns or not sides:
+                    break
+                mob = Entity("amoeba", 0, 0, 3, 1, "a", (55, 120, 50), ai=WonderAi(None))
+                mob.original = False
+                if not self.spawn("entities", mob, *random.choice(sides)):
+                    break
+
+        for e in self.components["arrowtrap"]:
+            e.lifetime -= turns
+            if e.lifetime <= 0:
+                self.despawn("arrowtrap", e)
+
+        self.flush()
+        # nobody is awake any more, the player may not even be close
+        self.scheduler = Scheduler()
+
+    def wander(self, x, y, steps):
+        free = self.free
+        for _ in range(steps):
+            dx, dy = random.choice(STEPS)
+            if free.is_free(x + dx, y + dy):
+                x += dx
+                y += dy
+        return x, y
+
+    def near_stairs(self, e):
+        return any(abs(e.x - x) <= WAKE_RADIUS and abs(e.y - y) <= WAKE_RADIUS for x, y in (self.up_stairs, self.down_stairs))
 
     def create_floor(self, grid_w, grid_h):
-        grid = [["#" for _ in range(grid_w)] for _ in range(grid_h)]
+        grid = TileGrid(grid_w, grid_h)
         rooms = []
+        # rooms and corridors are kept around for pathfinding, see RoomGraph
+        self.room_graph = RoomGraph(grid_w, grid_h)
 
-        room_count = random.randint(7, 20)
+        # as many rooms per area as the classic 40x20 floor, so big maps aren't all rock
+        scale = max(1, (grid_w * grid_h) // (40 * 20))
+        room_count = self.rng.randint(7, 20) * scale
         room_min_size = 3
         room_max_size = 5
 
-        for _ in range(room_count):
-            w = random.randint(room_min_size, room_max_size)
-            h = random.randint(room_min_size, room_max_size)
-            x = random.randint(1, grid_w - w - 2)
-            y = random.randint(1, grid_h - h - 2)
+        # a few tries per room, some land on top of others and get dropped
+        for _ in range(room_count * 3):
+            if len(rooms) == room_count:
+                break
+            w = self.rng.randint(room_min_size, room_max_size)
+            h = self.rng.randint(room_min_size, room_max_size)
+            x = self.rng.randint(1, grid_w - w - 2)
+            y = self.rng.randint(1, grid_h - h - 2)
+
+            # keep a wall between rooms, a room that would touch another is dropped
+            if grid.rect_has(x - 1, y - 1, w + 2, h + 2, "."):
+                continue
 
             # store the center for connecting later
-            center = (x + w // 2, y + h // 2)
-            rooms.append(center)
-
-            # carve out the room
-            for yy in range(y, y + h):
-                for xx in range(x, x + w):
-                    grid[yy][xx] = "."
-
-        for i in range(1, len(rooms)):
-            x1, y1 = rooms[i - 1]
-            x2, y2 = rooms[i]
-
-            if random.random() < 0.5:
-                for x in range(min(x1, x2), max(x1, x2) + 1):
-                    grid[y1][x] = "."
-                for y in range(min(y1, y2), max(y1, y2) + 1):
-                    grid[y][x2] = "."
+            rooms.append((x + w // 2, y + h // 2))
+            self.room_graph.add_room(x, y, w, h)
+            grid.fill_rect(x, y, w, h, ".")
+
+        def line(a, b):
+            return range(a, b + 1, 1) if b >= a else range(a, b - 1, -1)
+
+        # chain the rooms in bands across the map, snaking left to right then
+        # right to left, so each corridor runs to a room close by
+        band = 20
+        order = sorted(range(len(rooms)), key=lambda i: (rooms[i][1] // band, rooms[i][0] * (-1 if rooms[i][1] // band % 2 else 1)))
+
+        for a, b in zip(order, order[1:]):
+            x1, y1 = rooms[a]
+            x2, y2 = rooms[b]
+
+            # L shaped corridor, walked from the previous room's center to this one's
+            if self.rng.random() < 0.5:
+                grid.hline(x1, x2, y1, ".")
+                grid.vline(x2, y1, y2, ".")
+                corridor = [(x, y1) for x in line(x1, x2)] + [(x2, y) for y in line(y1, y2)]
             else:
-                for y in range(min(y1, y2), max(y1, y2) + 1):
-                    grid[y][x1] = "."
-                for x in range(min(x1, x2), max(x1, x2) + 1):
-                    grid[y2][x] = "."
-
-        ## add stairs < and >
-        stair_up_x, stair_up_y = self.find_valid_spawn(grid)
-        grid[stair_up_y][stair_up_x] = "<"
-        stair_down_x, stair_down_y = self.find_valid_spawn(grid)
-        grid[stair_down_y][stair_down_x] = ">"
+                grid.vline(x1, y1, y2, ".")
+                grid.hline(x1, x2, y2, ".")
+                corridor = [(x1, y) for y in line(y1, y2)] + [(x, y2) for x in line(x1, x2)]
+            self.room_graph.add_corridor(a, b, corridor)
+        self.room_graph.link_adjacent()
+
+        # the corridors chain every room, one flood fill makes sure of it
+        x, y = rooms[order[0]]
+        reached = grid.flood(x, y)
+        assert all(reached[y * grid_w + x] for x, y in rooms), "floor is not connected"
+
+        ## add stairs < and >, on two different open tiles. kept so taking the
+        ## stairs doesn't have to look for them
+        open_tiles = grid.open_tiles()
+        self.up_stairs = open_tiles.pop(self.rng.randrange(len(open_tiles)))
+        self.down_stairs = open_tiles.pop(self.rng.randrange(len(open_tiles)))
+        grid.set(*self.up_stairs, "<")
+        grid.set(*self.down_stairs, ">")
 
         return grid
 
     def is_movable(self, x, y):
-        return self.grid[y][x] != "#"
+        return self.grid.passable(x, y)
+
+    def set_tile(self, x, y, ch):
+        blocking = self.grid.blocks_sight(x, y)
+        self.grid.set(x, y, ch)
+        if blocking != self.grid.blocks_sight(x, y):
+            self.version += 1
+        if ch == ".":
+            self.free.put((x, y))
+        else:
+            self.free.take((x, y))
+        self.explored.refresh(x, y, self.grid)
 
     def move_tile(self, entity, x, y):
         # check for walls and other stuff here
@@ -179,8 +611,7 @@ class Floor:
         if not self.is_movable(new_x, new_y):
             return
 
-        entity.x = new_x
-        entity.y = new_y
+        self.place(entity, new_x, new_y)
 
     # kinda want this to be a system, but not sure how yet...
     def move_entity(self, entity, x, y):
@@ -188,11 +619,11 @@ class Floor:
         new_x = entity.x + x
         new_y = entity.y + y
 
-        if not self.is_movable(new_x, new_y):
+        if not self.is_movable(new_x, new_y) or (new_x, new_y) in self.commands.reserved:
             return
 
-        for e in self.components["entities"]:
-            if e is not entity and e.x == new_x and e.y == new_y:
+        for e in self.index["entities"].at(new_x, new_y):
+            if e is not entity:
 
                 # attack seq (entity then other: e)
                 # basic attack stuff
@@ -200,29 +631,124 @@ class Floor:
                 if entity.weapon:
                     damage = random.randint(entity.weapon.min_damage + entity.strength, entity.weapon.max_damage + entity.strength)
                 e.health -= damage
+                self.scheduler.wake(e)
+                emit = self.world.events.emit
 
-                self.world.log_message( f"{entity.name} attacks {e.name} for {damage}!" )
+                emit(Attack(entity, e, damage))
                 if e.health <= 0:
-                    self.world.log_message(f"{e.name} dies!")
+                    emit(Death(e))
                     e.dead = True
+                    self.despawn("entities", e)
                     entity.experience += e.ex_gain
-                    self.world.log_message( f"{entity.name} gains {e.ex_gain} experience!" )
+                    emit(ExperienceGained(entity, e.ex_gain))
                     entity.score += e.ex_gain
                     if entity.experience >= entity.experience_to_level:
                         entity.level_up()
-                        self.world.log_message( f"{entity.name} levels up to level {entity.level}!" )
+                        emit(LevelUp(entity, entity.level))
                         entity.score += 50
                     if entity.health <= 0:
-                        self.world.log_message(f"{entity.name} dies!")
+                        emit(Death(entity))
                         entity.dead = True
+                        self.despawn("entities", entity)
                 return
 
         entity.x = new_x
         entity.y = new_y
+        self.index["entities"].update(entity)
+
+    def place(self, obj, x, y):
+        """Moves anything on the floor to (x, y), keeping the spatial index in step"""
+        obj.x = x
+        obj.y = y
+        for index in self.index.values():
+            if obj in index.where:
+                index.update(obj)
+
+    def player_flow(self):
+        """FlowField toward the player, shared by every mob that chases or flees"""
+        player = self.world.player
+        key = (player.x, player.y, self.version)
+        if key != self.flow_key:
+            self.flow = FlowField(self, player.x, player.y, self.flow_radius)
+            self.flow_key = key
+        return self.flow
+
+    def find_path(self, start, goal, local_range=16):
+        """Tile path from start toward goal, planned room by room.
+
+        Nearby goals get a plain A*. Far ones are routed through the room graph
+        first and only the stretch to the next room on that route is searched
+        tile by tile, so the path can stop short of the goal. Callers walk it
+        and ask again.
+        """
+        if heuristic(start, goal) <= local_range:
+            path = astar_path(self, start, goal, 64 * (local_range + 1))
+            if path:
+                return path
+            # close by but a long walk round, go by the rooms after all
+
+        waypoint = self.room_graph.waypoint(start, goal, self.version, local_range)
+        if waypoint is None:
+            # not on any room or corridor we know of, search the whole thing
+            return astar_path(self, start, goal)
+        return astar_path(self, start, waypoint, 64 * (heuristic(start, waypoint) + 1))
 
     def update(self):
+        # whatever the player's move killed
+        self.flush()
         for system in self.systems:
             system.run(self)
+            self.flush()
+
+    def spawn(self, kind, obj, x, y):
+        """Queues obj to appear at (x, y) once the running system is done.
+
+        Entities count against the population budget, returns False when the
+        spawn was refused.
+        """
+        if kind == "entities":
+            if len(self.components["entities"]) + self.commands.pending >= self.population_budget:
+                if self.over_budget != "evict" or not self.evict_replica():
+                    return False
+            self.commands.pending += 1
+            # nothing else may spawn or walk there before the flush
+            self.commands.reserved.add((x, y))
+            self.free.take((x, y))
+        self.commands.spawns.append((kind, obj, x, y))
+        return True
+
+    def despawn(self, kind, obj):
+        """Queues obj to be removed once the running system is done"""
+        self.commands.despawns.append((kind, obj))
+
+    def evict_replica(self):
+        while self.replicas:
+            e = self.replicas.popleft()
+            if e in self.components["entities"] and not e.dead:
+                e.dead = True
+                self.despawn("entities", e)
+                # it only leaves at the flush, don't count it twice meanwhile
+                self.commands.pending -= 1
+                return True
+        return False
+
+    def flush(self):
+        """Applies everything systems queued with spawn and despawn"""
+        commands = self.commands
+        for kind, obj in commands.despawns:
+            self.components[kind].remove(obj)
+            self.index[kind].remove(obj)
+        for kind, obj, x, y in commands.spawns:
+            obj.x = x
+            obj.y = y
+            if kind not in self.components:
+                self.components[kind] = ComponentSet()
+                self.index[kind] = SpatialIndex(self.free)
+            self.components[kind].append(obj)
+            self.index[kind].add(obj)
+            if kind == "entities" and self.over_budget == "evict":
+                self.replicas.append(obj)
+        commands.clear()
 
 
     def add_system(self, system):
@@ -239,6 +765,7 @@ class Floor:
                     value.x = x
                     value.y = y
                     self.components[component].append(value)
+                    self.index[component].add(value)
                 else:
                     self.components[component].append(value)
         else:
@@ -247,32 +774,25 @@ class Floor:
                     x, y = self.find_valid_spawn(self.grid)
                     value.x = x
                     value.y = y
-                    self.components[component] = [value]
+                    self.components[component] = ComponentSet([value])
+                    self.index[component] = SpatialIndex(self.free)
+                    self.index[component].add(value)
                 else:
-                    self.components[component] = [value]
+                    self.components[component] = ComponentSet([value])
 
 
     def find_valid_spawn(self, grid):
-        height = len(grid)
-        width = len(grid[0])
-        while True:
-            x = random.randint(0, width - 1)
-            y = random.randint(0, height - 1)
-            if grid[y][x] == ".":
-                return (x, y)
+        """A random open tile, one nothing stands on whenever there is one"""
+        pos = self.free.sample(self.rng)
+        if pos is None:
+            # every tile is taken, share one
+            pos = self.rng.choice(grid.open_tiles())
+        return pos
 
 
     def find_up_stairs(self, grid):
-        for y in range(len(grid)):
-            for x in range(len(grid[y])):
-                if grid[y][x] == "<":
-                    return (x, y)
-        return None
+        return self.up_stairs
 
 
     def find_down_stairs(self, grid):
-        for y in range(len(grid)):
-            for x in range(len(grid[y])):
-                if grid[y][x] == ">":
-                    return (x, y)
-        return None
+        return self.down_stairs
@@ -0,0 +1,113 @@
+"""Field of view using symmetric shadowcasting.
+
+This is Albert Ford's "Symmetric Shadowcasting" with the slopes kept as
+integer fractions. Each quadrant is swept row by row and only the tiles that
+are in view get visited, so the cost is proportional to the number of visible
+tiles instead of the r^3 of casting a ray to every tile. It is also symmetric,
+if A can see B then B can see A.
+"""
+
+# (col x, depth x, col y, depth y) multipliers for the north, south, east and west quadrants
+QUADRANTS = [
+    (1, 0, 0, -1),
+    (1, 0, 0, 1),
+    (0, 1, 1, 0),
+    (0, -1, 1, 0),
+]
+
+
+def compute_fov(is_blocking, width, height, ox, oy, radius):
+    """Returns the set of tiles visible from (ox, oy) as (y, x) tuples.
+
+    `is_blocking(x, y)` tells if a tile stops sight, anything out of bounds
+    does too. Walls that stop sight are still visible themselves.
+    """
+    visible = {(oy, ox)}
+    r2 = radius * radius
+
+    for cx, dx, cy, dy in QUADRANTS:
+        # rows are (depth, start slope, end slope), slopes as numerator / denominator
+        rows = [(1, -1, 1, 1, 1)]
+        while rows:
+            depth, sn, sd, en, ed = rows.pop()
+
+            # round ties up for the first column, down for the last
+            min_col = (2 * depth * sn + sd) // (2 * sd)
+            max_col = -((ed - 2 * depth * en) // (2 * ed))
+
+            prev_wall = None
+            for col in range(min_col, max_col + 1):
+                x = ox + col * cx + depth * dx
+                y = oy + col * cy + depth * dy
+                in_bounds = 0 <= x < width and 0 <= y < height
+                wall = not in_bounds or is_blocking(x, y)
+
+                # floors are only revealed when the center is inside the row's slopes,
+                # that is what makes the result symmetric
+                if in_bounds and col * col + depth * depth <= r2:
+                    if wall or (col * sd >= depth * sn and col * ed <= depth * en):
+                        visible.add((y, x))
+
+                if prev_wall and not wall:
+                    sn, sd = 2 * col - 1, 2 * depth
+                elif prev_wall is False and wall and depth < radius:
+                    rows.append((depth + 1, sn, sd, 2 * col - 1, 2 * depth))
+                prev_wall = wall
+
+            if prev_wall is False and depth < radius:
+                rows.append((depth + 1, sn, sd, en, ed))
+
+    return visible
+
+
+class ExploredMap:
+    """What the player has seen of one floor, one byte per tile.
+
+    `walls` is the mask of walls worth drawing: walls next to a seen floor
+    tile. It is only touched for tiles that get seen for the first time, so
+    the renderer never has to look at a wall's neighbours itself.
+
+    `pos in explored` takes (y, x) like the old seen_tiles set did.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.seen = bytearray(width * height)
+        self.walls = bytearray(width * height)
+
+    def __contains__(self, pos):
+        y, x = pos
+        return self.seen[y * self.width + x] == 1
+
+    def wall_revealed(self, x, y):
+        return self.walls[y * self.width + x] == 1
+
+    def reveal(self, tiles, grid):
+        """Marks (y, x) tiles as seen, returns the ones that were new"""
+        new = []
+        for y, x in tiles:
+            i = y * self.width + x
+            if not self.seen[i]:
+                self.seen[i] = 1
+                new.append((y, x))
+                if grid.tile(x, y) == ".":
+                    self.reveal_walls_around(x, y, grid)
+        return new
+
+    def reveal_walls_around(self, x, y, grid):
+        for nx, ny in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if 0 <= nx < self.width and 0 <= ny < self.height and grid.tile(nx, ny) == "#":
+                self.walls[ny * self.width + nx] = 1
+
+    def refresh(self, x, y, grid):
+        """Redo the wall mask around a tile that changed"""
+        for nx, ny in ((x, y), (x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if not (0 <= nx < self.width and 0 <= ny < self.height):
+                continue
+            self.walls[ny * self.width + nx] = 0
+            if grid.tile(nx, ny) == "#":
+                for ax, ay in ((nx - 1, ny), (nx + 1, ny), (nx, ny - 1), (nx, ny + 1)):
+                    if 0 <= ax < self.width and 0 <= ay < self.height and grid.tile(ax, ay) == "." and self.seen[ay * self.width + ax]:
+                        self.walls[ny * self.width + nx] = 1
+                        break
@@ -1,205 +1,220 @@
+import argparse
+import os
 import pygame
 import sys
-import random
-
-
+import zlib
 
+from collections import OrderedDict
 from enum import Enum, auto
-from entities import Entity, create_random_mob, Weapon
-from floor import Floor 
-
-
-pygame.init()
+import replay
+import save
+from profiler import Profiler
+from world import World, State, Action, LOG_HISTORY
 
 
 FONTSIZE = 32
-GRID_W = 40
-GRID_H = 20
 LOG_SIZE = 9
 TOP_BAR_SIZE = 3
+ANIMATION_FPS = 30
+
+# keys that turn into world actions, everything else is handled by the front end
+KEYS = {
+    pygame.K_UP: Action.UP,
+    pygame.K_DOWN: Action.DOWN,
+    pygame.K_RIGHT: Action.RIGHT,
+    pygame.K_LEFT: Action.LEFT,
+    pygame.K_k: Action.UP,
+    pygame.K_j: Action.DOWN,
+    pygame.K_l: Action.RIGHT,
+    pygame.K_h: Action.LEFT,
+    pygame.K_PERIOD: Action.DESCEND,
+    pygame.K_COMMA: Action.ASCEND,
+    pygame.K_r: Action.RESTART,
+}
+
+
+class GlyphAtlas:
+    """Renders every (symbol, color) pair once and hands back the cached surface.
+
+    Map cells only ever use a handful of symbols and colors (fog of war just
+    adds a dimmed variant of each), so after the first few frames no text
+    rasterization happens for the map at all.
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self.glyphs = {}
+
+    def get(self, symbol, color):
+        key = (symbol, color)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            glyph = self.font.render(symbol, True, color)
+            self.glyphs[key] = glyph
+        return glyph
+
+
+class TextCache:
+    """Rendered text lines, so hud and log rows are only rasterized once.
+
+    Least recently used lines are dropped once the cache holds `size` of them.
+    """
+
+    def __init__(self, font, size):
+        self.font = font
+        self.size = size
+        self.lines = OrderedDict()
+
+    def get(self, text, color):
+        key = (text, color)
+        surface = self.lines.get(key)
+        if surface is None:
+            surface = self.font.render(text, True, color)
+            self.lines[key] = surface
+            if len(self.lines) > self.size:
+                self.lines.popitem(last=False)
+        else:
+            self.lines.move_to_end(key)
+        return surface
+
+
+class FrameBuffer:
+    """Remembers what is on screen right now so a frame only repaints what changed.
+
+    Map cells keep the glyph they were last drawn with, hud and log rows keep
+    their text. Every repaint is recorded as a rect for pygame.display.update.
+    """
+
+    def __init__(self, screen, atlas, text_cache, cell_size):
+        self.screen = screen
+        self.atlas = atlas
+        self.text_cache = text_cache
+        self.cell_size = cell_size
+        self.rects = []
+        self.blits = []
+        self.invalidate()
+
+    def invalidate(self):
+        self.state = None
+        self.floor = None
+        self.cells = {}
+        self.lines = {}
+        self.overlay = {}
+        self.visible = set()
+        self.hud = None
+
+    def draw_cell(self, px, py, glyph):
+        if self.cells.get((px, py)) == glyph:
+            return
+        self.cells[(px, py)] = glyph
+        rect = pygame.Rect(px, py, self.cell_size, self.cell_size)
+        self.screen.fill((0, 0, 0), rect)
+        if glyph:
+            self.blits.append((self.atlas.get(*glyph), (px, py)))
+        self.rects.append(rect)
+
+    def flush(self):
+        # all the changed cells go out in one blits call
+        self.screen.blits(self.blits, False)
+        self.blits = []
+
+    def draw_line(self, py, text, color):
+        if self.lines.get(py) == text:
+            return
+        self.lines[py] = text
+        rect = pygame.Rect(0, py, self.screen.get_width(), self.cell_size)
+        self.screen.fill((0, 0, 0), rect)
+        if text:
+            self.screen.blit(self.text_cache.get(text, color), (0, py))
+        self.rects.append(rect)
+
+
+class Screen(Enum):
+    HELP = auto()
 
 
-font = pygame.font.SysFont("Consolas", FONTSIZE)
-screen = pygame.display.set_mode( ( GRID_W * FONTSIZE, GRID_H * FONTSIZE + (LOG_SIZE * FONTSIZE) + (TOP_BAR_SIZE * FONTSIZE)) )
-clock = pygame.time.Clock()
+class Game:
+    """pygame front end: draws a World and turns key presses into actions.
+
+    Everything it needs to draw with is passed in, so it works just as well
+    on an offscreen surface.
+    """
+
+    def __init__(self, world, screen, font, autosaver=None, recorder=None, record_path="lastrun.replay"):
+        self.world = world
+        self.autosaver = autosaver
+        self.recorder = recorder
+        self.record_path = record_path
+        self.screen = screen
+        self.font = font
+        self.frame = FrameBuffer(screen, GlyphAtlas(font), TextCache(font, LOG_HISTORY + 64), FONTSIZE)
+        self.dirty = True
+        self.help = False
+        self.log_scroll = 0
+        self.log_count = world.log_count
+        self.profiler = None
+        self.show_profile = False
 
+    @property
+    def animating(self):
+        # nothing moves between turns yet, once something does (projectiles,
+        # effects...) this keeps the main loop waking up to draw it
+        return False
 
-class State(Enum):
-    GAMEOVER = auto()
-    OVERWORLD = auto()
-    HELP = auto()
+    @property
+    def showing(self):
+        return Screen.HELP if self.help else self.world.state
 
+    def scroll_log(self, lines):
+        self.log_scroll = max(0, min(self.log_scroll + lines, len(self.world.log) - LOG_SIZE))
 
-class World:
-    def __init__(self):
-        self.state = State.OVERWORLD
-        self.player = Entity("player", 5, 5, 100, 5, (0, 255, 0), "@", Weapon("Sword", 30, "!", 5, 10))
-        self.floors = [Floor(self, GRID_W, GRID_H)]
-        self.current_floor = 0
-        self.add_mobs(3)
-        self.log = []
-        self.map.add_component("entities", self.player)
-        
-        # Fog of war system
-        self.visible_tiles = set()  # Tiles currently visible
-        self.seen_tiles = set()  # Tiles that have ever been seen on current floor
-        self.vision_radius = 8  # Vision range
-        self.floor_seen_tiles = {self.current_floor: self.seen_tiles}
-        self.calculate_fov()
-
-    def reset(self):
-        self.state = State.OVERWORLD
-        self.player = Entity("player", 5, 5, 100, 5, (0, 255, 0), "@", Weapon("Sword", 30, "!", 5, 10))
-        self.floors = [Floor(self, GRID_W, GRID_H)]
-        self.current_floor = 0
-        self.add_mobs(3)
-        self.log = []
-        self.map.add_component("entities", self.player)
-        
-        # Reset fog of war
-        self.visible_tiles = set()
-        self.seen_tiles = set()
-        self.floor_seen_tiles = {self.current_floor: self.seen_tiles}
-        self.calculate_fov()
+    def cell_glyph(self, x, y, ch, map_overlay):
+        """(symbol, color) for a single map cell, or None when the cell is blank"""
+        world = self.world
+        pos = (y, x)
 
-    def add_mobs(self, num):
-        for _ in range(num):
-            mob = create_random_mob()
-            self.map.add_component("entities", mob)
+        # If not seen at all, show black
+        if pos not in world.seen_tiles:
+            return None
 
-    @property
-    def map(self):
-        return self.floors[self.current_floor]
-
-    def go_down_stairs(self):
-        # Store explored tiles for the current floor before leaving
-        self.floor_seen_tiles[self.current_floor] = self.seen_tiles
-
-        if self.current_floor == len(self.floors) - 1:
-            new_floor = Floor(self, GRID_W, GRID_H)
-            # fill with mobs
-            for _ in range(random.randint(1, self.current_floor + 4)):
-
-                mob = create_random_mob()
-                x, y = new_floor.find_valid_spawn(new_floor.grid)
-                mob.x = x
-                mob.y = y
-
-                for _ in range(random.randint(self.current_floor, self.current_floor + 3)):
-                    mob.level_up()
-                    
-                mob.set_ex(mob.ex_gain + self.current_floor * 2)
-
-                new_floor.add_component("entities", mob)
-
-            new_floor.add_component("entities", self.player)
-
-            self.floors.append(new_floor)
-
-        self.current_floor += 1
-        self.player.x, self.player.y = self.map.find_up_stairs(self.map.grid)
-        # Reset fog of war for new floor
-        self.visible_tiles = set()
-        self.seen_tiles = self.floor_seen_tiles.setdefault(self.current_floor, set())
-        self.floor_seen_tiles[self.current_floor] = self.seen_tiles
-        self.calculate_fov()
-
-    def go_up_stairs(self):
-        # Store explored tiles for the current floor before leaving
-        self.floor_seen_tiles[self.current_floor] = self.seen_tiles
-
-        self.current_floor -= 1
-        self.player.x, self.player.y = self.map.find_down_stairs(self.map.grid)
-        # Reset fog of war for new floor
-        self.visible_tiles = set()
-        self.seen_tiles = self.floor_seen_tiles.setdefault(self.current_floor, set())
-        self.floor_seen_tiles[self.current_floor] = self.seen_tiles
-        self.calculate_fov()
-
-    # log can only show 8, so perhaps list needs to erase non visable ones, otherwise
-    # list could grow and waste memory. unless there is a log history feature at some point?
-    def log_message(self, message):
-        self.log.append(message)
-        while len(self.log) > 9:
-            self.log.pop(0)
-
-    def calculate_fov(self):
-        """Calculate field of view using raycasting - walls block vision"""
-        self.visible_tiles = set()
-        px, py = self.player.x, self.player.y
-        
-        # Add player position as visible (note: using (y, x) format for consistency)
-        self.visible_tiles.add((py, px))
-        self.seen_tiles.add((py, px))
-        
-        # Cast rays to all tiles within vision radius
-        for dx in range(-self.vision_radius, self.vision_radius + 1):
-            for dy in range(-self.vision_radius, self.vision_radius + 1):
-                distance = (dx * dx + dy * dy) ** 0.5
-                if distance > self.vision_radius:
-                    continue
-                
-                # Cast ray from player to this tile using Bresenham-like algorithm
-                target_x = px + dx
-                target_y = py + dy
-                
-                # Check bounds
-                if target_x < 0 or target_x >= GRID_W or target_y < 0 or target_y >= GRID_H:
-                    continue
-                
-                # Cast ray
-                x0, y0 = px, py
-                x1, y1 = target_x, target_y
-                
-                # Use integer-based line drawing
-                steps = max(abs(x1 - x0), abs(y1 - y0))
-                
-                if steps == 0:
-                    self.visible_tiles.add((y0, x0))  # (y, x) format
-                    self.seen_tiles.add((y0, x0))
-                    continue
-                
-                for step in range(steps + 1):
-                    if steps > 0:
-                        t = step / steps
-                        x = int(x0 + (x1 - x0) * t)
-                        y = int(y0 + (y1 - y0) * t)
-                    else:
-                        x, y = x0, y0
-                    
-                    # Check bounds
-                    if x < 0 or x >= GRID_W or y < 0 or y >= GRID_H:
-                        break
-                    
-                    # Add to visible tiles (before checking if wall) - using (y, x) format
-                    self.visible_tiles.add((y, x))
-                    self.seen_tiles.add((y, x))
-                    
-                    # Check if wall blocks vision (stop here, can't see beyond)
-                    if self.map.grid[y][x] == "#":
-                        break
-
-    def update(self):
-        self.map.update()
-        
-        # Calculate field of view
-        self.calculate_fov()
-        
-        if self.player.health <= 0:
-            self.state = State.GAMEOVER
+        is_visible = pos in world.visible_tiles
+        color = (255, 255, 255)
+        # If seen but not visible, show dimmed (fog of war)
+        dimmed_color = (80, 80, 80)  # Dark gray for fog of war
+
+        if pos in map_overlay:
+            if map_overlay[pos][1] == "@":
+                # Player is always visible
+                return ("@", (0, 255, 0))
+            symbol_color = map_overlay[pos][1] if is_visible else dimmed_color
+            return (str(map_overlay[pos][0]), symbol_color)
+
+        render_color = color if is_visible else dimmed_color
+        if ch == "#":
+            return ("#", render_color) if world.map.explored.wall_revealed(x, y) else None
+        elif ch == "<":
+            if world.current_floor == 0:
+                return (".", render_color)
+            stair_color = (255, 215, 0) if is_visible else dimmed_color
+            return ("<", stair_color)
+        elif ch == ">":
+            stair_color = (255, 215, 0) if is_visible else dimmed_color
+            return (">", stair_color)
+        return (ch, render_color)
 
     def draw_overworld(self):
+        world = self.world
         color = (255, 255, 255)
         under_player = []
         map_overlay = {}
         
         # First pass: collect all overlay items (only visible ones)
-        for overlay_name, overlay in self.map.components.items():
+        for overlay_name, overlay in world.map.components.items():
             for obj in overlay:
                 pos = (obj.y, obj.x)
                 
                 # Only add to overlay if visible
-                if pos not in self.visible_tiles:
+                if pos not in world.visible_tiles:
                     continue
                 
                 # this kind of sucks. all items need some sort of visablity
@@ -227,197 +242,246 @@ class World:
                         under_player.append(obj.name)
                     continue
 
-        height = len(self.map.grid)
-        width = len(self.map.grid[0])
+        height = world.map.grid.height
+        width = world.map.grid.width
         
-        if self.map.grid[self.player.y][self.player.x] == "<":
+        if world.map.grid[world.player.y][world.player.x] == "<":
             under_player.append("up stairs")
 
-        if self.map.grid[self.player.y][self.player.x] == ">":
+        if world.map.grid[world.player.y][world.player.x] == ">":
             under_player.append("down stairs")
 
-        def wall_visible(yy, xx):
-            if self.map.grid[yy][xx] != "#":
-                return False
-            # Wall is visible if adjacent to a seen floor tile
-            for dy, dx in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                ny, nx = yy + dy, xx + dx
-                if 0 <= ny < height and 0 <= nx < width:
-                    if (ny, nx) in self.seen_tiles and self.map.grid[ny][nx] == ".":
-                        return True
-            return False
-
         top_bar_size_offset = (TOP_BAR_SIZE) * FONTSIZE
-        text = font.render( f"Name: {self.player.name} LVL: {str(self.player.level)} HP: {str(self.player.health)}/{str(self.player.max_health)} EX: {str(self.player.experience)}/{str(self.player.experience_to_level)} Damage: {str( self.player.weapon.min_damage + self.player.strength if self.player.weapon else 0)} - {str(self.player.weapon.max_damage + self.player.strength if self.player.weapon  else self.player.strength)}", True, color, )
-        screen.blit(text, (0, 0))
-        text = font.render( f"Floor: {self.current_floor} Score: {str(self.player.score)} | Press ? for help", True, color, )
-        screen.blit(text, (0, FONTSIZE ))
-        things_under_player = " ".join([item for item in under_player])
-
-        if things_under_player:
-            text = font.render( things_under_player, True, color, )
-            screen.blit(text, (0, FONTSIZE * 2))
-
-        for y, row in enumerate(self.map.grid):
-            for x, ch in enumerate(row):
-                pos = (y, x)
-                is_visible = pos in self.visible_tiles
-                is_seen = pos in self.seen_tiles
-                
-                # If not seen at all, show black
-                if not is_seen:
-                    text = font.render(" ", True, (0, 0, 0))
-                    screen.blit(text, (x * FONTSIZE, y * FONTSIZE + top_bar_size_offset))
-                    continue
-                
-                # If seen but not visible, show dimmed (fog of war)
-                dimmed_color = (80, 80, 80)  # Dark gray for fog of war
-                
-                if pos in map_overlay:
-                    if map_overlay[pos][1] == "@":
-                        # Player is always visible
-                        text = font.render("@", True, (0, 255, 0))
-                        screen.blit( text, (x * FONTSIZE, y * FONTSIZE + top_bar_size_offset) )
-                    else:
-                        symbol_color = map_overlay[pos][1] if is_visible else dimmed_color
-                        text = font.render( str(map_overlay[pos][0]), True, symbol_color )
-                        screen.blit( text, (x * FONTSIZE, y * FONTSIZE + top_bar_size_offset) )
-                else:
-                    render_color = color if is_visible else dimmed_color
-                    if ch == "#":
-                        if wall_visible(y, x):
-                            text = font.render("#", True, render_color)
-                        else:
-                            text = font.render(" ", True, (0, 0, 0))
-                    elif ch == "<":
-                        if world.current_floor == 0:
-                            text = font.render(".", True, render_color)
-                        elif world.current_floor >= 1:
-                            stair_color = (255, 215, 0) if is_visible else dimmed_color
-                            text = font.render("<", True, stair_color)
-                    elif ch == ">":
-                        stair_color = (255, 215, 0) if is_visible else dimmed_color
-                        text = font.render(">", True, stair_color)
-                    else:
-                        text = font.render(ch, True, render_color)
-                    screen.blit( text, (x * FONTSIZE, y * FONTSIZE + top_bar_size_offset) )
-
-        # draw log
-        log_start_y = GRID_H * FONTSIZE + top_bar_size_offset
-        for i, log_entry in enumerate(self.log[-LOG_SIZE:]):
-            text = font.render(log_entry, True, color)
-            screen.blit(text, (0, log_start_y + i * FONTSIZE))
-
-        
+        # the two stat lines only get rebuilt when something on them changed
+        weapon = world.player.weapon
+        hud = (world.player.level, world.player.health, world.player.max_health, world.player.experience, world.player.experience_to_level, world.player.strength, weapon, world.current_floor, world.player.score)
+        if self.frame.hud != hud:
+            self.frame.hud = hud
+            self.frame.draw_line(0, f"Name: {world.player.name} LVL: {str(world.player.level)} HP: {str(world.player.health)}/{str(world.player.max_health)} EX: {str(world.player.experience)}/{str(world.player.experience_to_level)} Damage: {str( weapon.min_damage + world.player.strength if weapon else 0)} - {str(weapon.max_damage + world.player.strength if weapon  else world.player.strength)}", color)
+            self.frame.draw_line(FONTSIZE, f"Floor: {world.current_floor} Score: {str(world.player.score)} | Press ? for help", color)
+        status = " ".join([item for item in under_player])
+        if self.show_profile:
+            status = f"{status} | {self.profiler.summary()}" if status else self.profiler.summary()
+        self.frame.draw_line(FONTSIZE * 2, status, color)
+
+        # only cells that can look different from the last frame get looked at:
+        # anything an overlay sat on before or sits on now, and every tile that
+        # came into or went out of view (plus its neighbours, walls get
+        # revealed next to newly seen floor)
+        if self.frame.floor is not world.map:
+            self.frame.floor = world.map
+            cells = [(y, x) for y in range(height) for x in range(width)]
+        else:
+            cells = set(self.frame.overlay) | set(map_overlay)
+            for y, x in self.frame.visible ^ world.visible_tiles:
+                cells.update(((y, x), (y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)))
+        self.frame.overlay = map_overlay
+        self.frame.visible = world.visible_tiles
+
+        for y, x in cells:
+            if 0 <= y < height and 0 <= x < width:
+                glyph = self.cell_glyph(x, y, world.map.grid.tile(x, y), map_overlay)
+                self.frame.draw_cell(x * FONTSIZE, y * FONTSIZE + top_bar_size_offset, glyph)
+        self.frame.flush()
+
+        # draw log, a scrolled back view stays on the same messages as new ones come in
+        if self.log_scroll:
+            self.scroll_log(world.log_count - self.log_count)
+        self.log_count = world.log_count
+        log_start_y = height * FONTSIZE + top_bar_size_offset
+        end = len(world.log) - self.log_scroll
+        start = max(0, end - LOG_SIZE)
+        for i in range(LOG_SIZE):
+            self.frame.draw_line(log_start_y + i * FONTSIZE, str(world.log[start + i]) if start + i < end else "", color)
 
     def draw_gameover(self):
         # print dead screen
-        text = font.render("You died!", True, (255, 0, 0))
-        screen.blit( text, (GRID_W * FONTSIZE // 2 - text.get_width() // 2, GRID_H * FONTSIZE // 2), )
+        text = self.font.render("You died!", True, (255, 0, 0))
+        self.screen.blit( text, (self.world.grid_w * FONTSIZE // 2 - text.get_width() // 2, self.world.grid_h * FONTSIZE // 2), )
         # show restart option
-        text = font.render("Press R to restart", True, (255, 255, 255))
-        screen.blit( text, ( GRID_W * FONTSIZE // 2 - text.get_width() // 2, GRID_H * FONTSIZE // 2 + FONTSIZE, ), )
+        text = self.font.render("Press R to restart", True, (255, 255, 255))
+        self.screen.blit( text, ( self.world.grid_w * FONTSIZE // 2 - text.get_width() // 2, self.world.grid_h * FONTSIZE // 2 + FONTSIZE, ), )
 
     def draw_help(self):
         help_lines = [
             "Controls:",
             "Arrow Keys / HJKL: Move",
             "., : Go Down/Up Stairs",
+            "PgUp/PgDn: Scroll Message Log",
+            "F3: Show Timings",
             "R: Restart Game",
             "Q / ESC: Quit Game",
             "",
             "Press any key to return...",
         ]
         for i, line in enumerate(help_lines):
-            text = font.render(line, True, (255, 255, 255))
-            screen.blit(text, (50, 50 + i * FONTSIZE))
+            text = self.font.render(line, True, (255, 255, 255))
+            self.screen.blit(text, (50, 50 + i * FONTSIZE))
 
     def draw(self):
-        # always reset screen to black
-        screen.fill((0, 0, 0))
-        match self.state:
+        """Repaint whatever changed since the last call, returns the dirty screen rects"""
+        if not self.dirty:
+            return []
+        self.dirty = False
+
+        showing = self.showing
+        if self.frame.state != showing:
+            # switching screens: reset to black and start from a clean buffer
+            self.screen.fill((0, 0, 0))
+            self.frame.invalidate()
+            self.frame.state = showing
+            self.frame.rects.append(self.screen.get_rect())
+        elif showing != State.OVERWORLD:
+            # help and game over screens are static
+            return []
+
+        match showing:
             case State.OVERWORLD:
                 self.draw_overworld()
             case State.GAMEOVER:
                 self.draw_gameover()
-            case State.HELP:
+            case Screen.HELP:
                 self.draw_help()
 
-    def handle_input(self, input):
-        match self.state:
-            case State.OVERWORLD:
-                match input:
-                    case pygame.K_UP:
-                        self.map.move_entity(self.player, 0, -1)
-                    case pygame.K_DOWN:
-                        self.map.move_entity(self.player, 0, 1)
-                    case pygame.K_RIGHT:
-                        self.map.move_entity(self.player, 1, 0)
-                    case pygame.K_LEFT:
-                        self.map.move_entity(self.player, -1, 0)
-
-                    case pygame.K_k:
-                        self.map.move_entity(self.player, 0, -1)
-                    case pygame.K_j:
-                        self.map.move_entity(self.player, 0, 1)
-                    case pygame.K_l:
-                        self.map.move_entity(self.player, 1, 0)
-                    case pygame.K_h:
-                        self.map.move_entity(self.player, -1, 0)
-
-                    case pygame.K_PERIOD:
-                        if self.map.grid[self.player.y][self.player.x] == ">":
-                            self.go_down_stairs()
-                        return
-
-                    case pygame.K_COMMA:
-                        if self.current_floor > 0 and world.map.grid[self.player.y][self.player.x] == "<" :
-                            world.go_up_stairs()
-                        return
-
-                    case pygame.K_r:
-                        self.reset()
-                        return
-
-                    case pygame.K_q:
-                        pygame.quit()
-                        sys.exit()
-
-                    case pygame.K_SLASH:
-                        self.state = State.HELP
-                        return
-
-                    case _:
-                        return
-
-                self.update()
-
-            case State.GAMEOVER:
-                match input:
-                    case pygame.K_r:
-                        self.reset()
-                    case _:
-                        pass
-
-            case State.HELP:
-                match input:
-                    case _:
-                        self.state = State.OVERWORLD
-                pass
+        rects = self.frame.rects
+        self.frame.rects = []
+        return rects
 
-
-# main game setup
-world = World()
-
-while True:
-    for event in pygame.event.get():
+    def handle_input(self, input):
+        self.dirty = True
+        if self.help:
+            # any key goes back to the game
+            self.help = False
+            return
+
+        if self.world.state == State.OVERWORLD:
+            match input:
+                case pygame.K_PAGEUP:
+                    self.scroll_log(LOG_SIZE - 1)
+                    return
+
+                case pygame.K_PAGEDOWN:
+                    self.scroll_log(-(LOG_SIZE - 1))
+                    return
+
+                case pygame.K_q:
+                    self.quit()
+
+                case pygame.K_SLASH:
+                    self.help = True
+                    return
+
+                case pygame.K_F3:
+                    self.toggle_profile()
+                    return
+
+        if input in KEYS:
+            action = KEYS[input]
+            used_turn = self.world.step(action)
+            if self.recorder:
+                self.recorder.record(self.world, action)
+            if used_turn and self.autosaver:
+                self.autosaver.tick(self.world)
+
+    def toggle_profile(self):
+        self.show_profile = not self.show_profile
+        if self.show_profile and not self.profiler:
+            self.profiler = Profiler()
+            self.profiler.install(self)
+        elif not self.show_profile and not self.profiler.out:
+            # only timing for the overlay, stop paying for it
+            self.profiler.uninstall()
+            self.profiler = None
+
+    def quit(self):
+        if self.profiler:
+            self.profiler.uninstall()
+        if self.autosaver:
+            self.autosaver.wait()
+            if self.world.state == State.OVERWORLD:
+                save.save(self.world, self.autosaver.path)
+            elif os.path.exists(self.autosaver.path):
+                # dead is dead, next start is a new run
+                os.remove(self.autosaver.path)
+        if self.recorder:
+            self.recorder.write(self.record_path)
+        pygame.quit()
+        sys.exit()
+
+
+def load_or_new(path):
+    """The saved run at path, or a new World if there is none or it can't be read"""
+    if not os.path.exists(path):
+        return World()
+    try:
+        return save.load(path)
+    except (ValueError, EOFError, zlib.error) as e:
+        # an old format or a broken file shouldn't keep the game from starting,
+        # keep it next to the new save in case it's worth a look
+        os.replace(path, path + ".bad")
+        print(f"couldn't load {path} ({e}), moved it to {path}.bad and started a new run")
+        return World()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="roguehack")
+    # by default the game only redraws when something changed, --fps redraws
+    # every frame at a fixed rate instead (handy for debugging)
+    parser.add_argument("--fps", type=int, default=0, help="redraw every frame at this rate")
+    # the run is saved here on quit and every --autosave turns, and picked up
+    # again on the next start
+    parser.add_argument("--save", default="savegame.dat", help="where the run is saved")
+    parser.add_argument("--autosave", type=int, default=50, help="save every N turns, 0 turns it off")
+    parser.add_argument("--profile", default=None, help="time every turn and frame into this jsonl file, see profiler.py")
+    # every action of the session is recorded and written here on quit
+    parser.add_argument("--record", default="lastrun.replay", help="play it back with python replay.py")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    pygame.init()
+    world = load_or_new(args.save)
+    font = pygame.font.SysFont("Consolas", FONTSIZE)
+    screen = pygame.display.set_mode( ( world.grid_w * FONTSIZE, world.grid_h * FONTSIZE + (LOG_SIZE * FONTSIZE) + (TOP_BAR_SIZE * FONTSIZE)) )
+    clock = pygame.time.Clock()
+
+    # main game setup
+    game = Game(world, screen, font, save.Autosaver(args.save, args.autosave), replay.Recorder(world), args.record)
+    if args.profile:
+        game.profiler = Profiler(args.profile)
+        game.profiler.install(game)
+
+    def handle_event(event):
         if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
+            game.quit()
         elif event.type == pygame.KEYDOWN:
-            world.handle_input(event.key)
-
-    world.draw()
-
-    pygame.display.flip()
-    clock.tick(30)
+            game.handle_input(event.key)
+        elif event.type == pygame.VIDEOEXPOSE:
+            # the window got uncovered, push the whole retained screen again
+            pygame.display.flip()
+
+    while True:
+        if args.fps:
+            # debug mode: spin at a fixed rate and repaint every frame
+            for event in pygame.event.get():
+                handle_event(event)
+            game.dirty = True
+            game.draw()
+            pygame.display.flip()
+            clock.tick(args.fps)
+            continue
+
+        # sleep until there is input, only wake up on a timer while something animates
+        timeout = 1000 // ANIMATION_FPS if game.animating else 0
+        handle_event(pygame.event.wait(timeout))
+        for event in pygame.event.get():
+            handle_event(event)
+
+        rects = game.draw()
+        if rects:
+            pygame.display.update(rects)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Where turns and frames spend their time, off unless asked for.
+
+    python game.py --profile turns.jsonl   (F3 shows the numbers in game)
+
+Profiler.install wraps the functions worth watching (every system's run,
+FOV, pathfinding, the flow field, event dispatch, the draw phases) in timers
+and puts the originals back on uninstall. Nothing is wrapped while it is off,
+so it costs nothing then.
+
+Phases can nest (EntitySystem includes the find_path calls its mobs make),
+so they add up to more than "turn". Every turn is written to the output file as one json object per line:
+
+    {"turn": 12, "floor": 0, "entities": 7, "awake": 3, "ms": {"EntitySystem": 0.21, ...}, "astar nodes": 40}
+"""
+import json
+import time
+
+from collections import defaultdict
+
+import entities
+import events
+import floor
+import world
+
+
+class Profiler:
+    def __init__(self, out=None):
+        self.out = open(out, "w") if out else None
+        self.turn = defaultdict(float)  # phase -> seconds, this turn so far
+        self.frame = defaultdict(float)  # same for the frame being drawn
+        self.counts = defaultdict(int)  # "astar nodes"... this turn
+        self.last_turn = {}
+        self.last_frame = {}
+        self.patches = []
+
+    def timed(self, fn, name, bucket):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                bucket[name] += time.perf_counter() - start
+        return wrapper
+
+    def patch(self, owner, attr, wrapper):
+        self.patches.append((owner, attr, getattr(owner, attr)))
+        setattr(owner, attr, wrapper)
+
+    def install(self, game=None):
+        """Starts timing, pass the Game to time its drawing too"""
+        for cls in (floor.EntitySystem, floor.ArrowTrapSystem, floor.PostionSystem):
+            self.patch(cls, "run", self.timed(cls.run, cls.__name__, self.turn))
+        self.patch(world.World, "calculate_fov", self.timed(world.World.calculate_fov, "fov", self.turn))
+        self.patch(floor.Floor, "find_path", self.timed(floor.Floor.find_path, "find_path", self.turn))
+        self.patch(floor.Floor, "player_flow", self.timed(floor.Floor.player_flow, "flow field", self.turn))
+        self.patch(events.EventBus, "dispatch", self.timed(events.EventBus.dispatch, "events", self.turn))
+
+        counts = self.counts
+
+        def astar_path(world, start, goal, max_nodes=None, stats=None):
+            counts["astar calls"] += 1
+            return entities.astar_path(world, start, goal, max_nodes, counts)
+        self.patch(floor, "astar_path", astar_path)
+
+        step = world.World.step
+        profiler = self
+
+        def counted_step(self, action):
+            # only what the turn itself does, not fov from a reset and such
+            profiler.turn.clear()
+            profiler.counts.clear()
+            start = time.perf_counter()
+            used = step(self, action)
+            if used:
+                profiler.turn["turn"] = time.perf_counter() - start
+                profiler.end_turn(self)
+            return used
+        self.patch(world.World, "step", counted_step)
+
+        if game is not None:
+            cls = type(game)
+            for name in ("draw_overworld", "draw_gameover", "draw_help"):
+                self.patch(cls, name, self.timed(getattr(cls, name), name, self.frame))
+            self.patch(type(game.frame), "flush", self.timed(type(game.frame).flush, "blit", self.frame))
+            draw = cls.draw
+
+            def timed_draw(self, *args):
+                start = time.perf_counter()
+                rects = draw(self, *args)
+                if rects:
+                    profiler.frame["frame"] = time.perf_counter() - start
+                    profiler.end_frame()
+                return rects
+            self.patch(cls, "draw", timed_draw)
+
+    def uninstall(self):
+        for owner, attr, original in reversed(self.patches):
+            setattr(owner, attr, original)
+        self.patches = []
+        if self.out:
+            self.out.close()
+            self.out = None
+
+    def end_turn(self, world):
+        mobs = world.map.components["entities"]
+        record = {
+            "turn": world.turn,
+            "floor": world.current_floor,
+            "entities": len(mobs),
+            "awake": len(world.map.scheduler.awake),
+            "ms": {name: round(seconds * 1000, 3) for name, seconds in self.turn.items()},
+            **self.counts,
+        }
+        if self.out:
+            self.out.write(json.dumps(record) + "\n")
+        self.last_turn = record
+        self.turn.clear()
+        self.counts.clear()
+
+    def end_frame(self):
+        self.last_frame = {name: seconds * 1000 for name, seconds in self.frame.items()}
+        self.frame.clear()
+
+    def summary(self):
+        """One line for the in game overlay"""
+        turn = self.last_turn
+        frame = self.last_frame.get("frame", 0)
+        return (f"frame {frame:.1f}ms turn {turn.get('ms', {}).get('turn', 0):.1f}ms"
+                f" ents {turn.get('entities', 0)} awake {turn.get('awake', 0)} A* {turn.get('astar nodes', 0)}")
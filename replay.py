@@ -0,0 +1,197 @@
+"""Recording a run and playing it back headless, as fast as it goes.
+
+    python replay.py lastrun.replay [--no-check] [--profile turns.jsonl]
+    python replay.py --selftest [N]
+
+A run is its starting world plus every action given to World.step. The mob
+AI and combat rolls use the global random module, so a recording reseeds it
+when it starts and keeps the seed. Given both, World.step is deterministic,
+and the replay ends up in exactly the state the recorded run did.
+
+A recording also keeps a short hash of the world every CHECKPOINT_EVERY
+actions. Replay compares them as it goes and stops at the first mismatch,
+which is how a change in game logic shows up as a divergence.
+
+    recorder = Recorder(world)       # reseeds random, snapshots the world
+    world.step(action); recorder.record(world, action)
+    recorder.write("lastrun.replay")
+    world = replay.replay("lastrun.replay")
+
+--selftest records N seeded sessions that go up and down the stairs, writes
+them out and replays them, run it after touching anything a snapshot or the
+world's determinism depends on.
+"""
+import argparse
+import hashlib
+import marshal
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+import save
+from entities import FlowField
+from world import World, Action, MOVES
+
+MAGIC = b"RLRPLY"
+FORMAT = 1
+HEADER = struct.Struct(">6sH")
+
+CHECKPOINT_EVERY = 100
+
+# an action is stored as one byte, its place in this list
+ACTIONS = list(Action)
+CODES = {action: i for i, action in enumerate(ACTIONS)}
+
+
+def world_hash(world):
+    """8 bytes that change whenever anything saved about the world does"""
+    # not marshal.dumps: its bytes depend on which objects happen to be shared
+    # or interned, so equal snapshots can encode differently. the snapshot is
+    # only plain tuples, lists, dicts, strings, ints and bytes, and their repr
+    # is the same for equal values
+    return hashlib.blake2b(repr(save.snapshot(world)).encode(), digest_size=8).digest()
+
+
+class Recorder:
+    def __init__(self, world, every=CHECKPOINT_EVERY):
+        self.start = save.snapshot(world)
+        self.seed = random.getrandbits(64)
+        random.seed(self.seed)
+        self.every = every
+        self.actions = bytearray()
+        self.checkpoints = []
+
+    def record(self, world, action):
+        """Call after world.step(action), with the world it stepped"""
+        self.actions.append(CODES[action])
+        if self.every and len(self.actions) % self.every == 0:
+            self.checkpoints.append(world_hash(world))
+
+    def encode(self):
+        data = (self.start, self.seed, self.every, bytes(self.actions), self.checkpoints)
+        return HEADER.pack(MAGIC, FORMAT) + zlib.compress(marshal.dumps(data), 9)
+
+    def write(self, path):
+        save.write_file(path, self.encode())
+
+
+def decode(blob):
+    magic, version = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("not a replay file")
+    if version != FORMAT:
+        raise ValueError(f"replay file is format {version}, this version reads {FORMAT}")
+    return marshal.loads(zlib.decompress(blob[HEADER.size:]))
+
+
+def replay(path, check=True):
+    """Plays the recording back, returns the world it ends on.
+
+    Raises ValueError at the first checkpoint the world doesn't match, unless
+    check is False.
+    """
+    with open(path, "rb") as f:
+        start, seed, every, actions, checkpoints = decode(f.read())
+    world = save.restore(start)
+    random.seed(seed)
+    step = world.step
+    for i, code in enumerate(actions, 1):
+        step(ACTIONS[code])
+        if check and every and i % every == 0:
+            if world_hash(world) != checkpoints[i // every - 1]:
+                raise ValueError(f"replay diverged by action {i} (turn {world.turn}, floor {world.current_floor})")
+    return world
+
+
+def stair_walker(world, rng, down):
+    """Action that mostly walks toward the stairs (down or up), sometimes anywhere"""
+    player = world.player
+    tile = world.map.grid[player.y][player.x]
+    if tile == ">" and down:
+        return Action.DESCEND
+    if tile == "<" and not down:
+        return Action.ASCEND
+    if rng.random() < 0.3:
+        return rng.choice(list(MOVES))
+    stairs = world.map.find_down_stairs(world.map.grid) if down else world.map.find_up_stairs(world.map.grid)
+    step = FlowField(world.map, *stairs).step_toward(player.x, player.y)
+    for action, move in MOVES.items():
+        if move == step:
+            return action
+    return rng.choice(list(MOVES))
+
+
+def selftest(games, turns=600, depth=4):
+    """Records games that dive to depth and climb back, checks each replays to the
+    same world and hashes the same after a save and load"""
+    path = os.path.join(tempfile.mkdtemp(), "selftest.replay")
+    for seed in range(games):
+        # the walker has its own rng, the recording owns the global one
+        rng = random.Random(seed)
+        world = World(seed=seed)
+        world.player.health = world.player.max_health = 10**6
+        recorder = Recorder(world, every=20)
+        down = True
+        for _ in range(turns):
+            action = stair_walker(world, rng, down)
+            world.step(action)
+            recorder.record(world, action)
+            if world.current_floor >= depth:
+                down = False
+            elif world.current_floor == 0:
+                down = True
+        recorder.write(path)
+        if world_hash(replay(path)) != world_hash(world):
+            raise ValueError(f"game {seed} replayed to a different world")
+        # a recording can start from a loaded save, which has to hash the same
+        if world_hash(save.restore(save.snapshot(world))) != world_hash(world):
+            raise ValueError(f"game {seed} hashes differently after a save and load")
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", nargs="?")
+    parser.add_argument("--selftest", type=int, nargs="?", const=12, default=None, metavar="N",
+                        help="record N sessions, replay them and check they match")
+    parser.add_argument("--no-check", action="store_true", help="skip the checkpoint hashes, only time the turns")
+    parser.add_argument("--profile", default=None, help="write per turn timings here, see profiler.py")
+    args = parser.parse_args()
+
+    if args.selftest is not None:
+        try:
+            selftest(args.selftest)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        print(f"{args.selftest} recorded games replayed the same")
+        return
+    if args.path is None:
+        parser.error("a replay file to play, or --selftest")
+
+    profiler = None
+    if args.profile:
+        from profiler import Profiler
+        profiler = Profiler(args.profile)
+        profiler.install()
+
+    start = time.perf_counter()
+    try:
+        world = replay(args.path, check=not args.no_check)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    finally:
+        if profiler:
+            profiler.uninstall()
+    elapsed = time.perf_counter() - start
+    print(f"replayed to turn {world.turn} on floor {world.current_floor} in {elapsed:.2f}s, player {world.state.name.lower()}")
+
+
+if __name__ == "__main__":
+    main()
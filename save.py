@@ -0,0 +1,154 @@
+"""Saving and loading a whole World.
+
+A save file is a small header (magic + format version) followed by one
+zlib-compressed marshal blob of plain tuples, lists and bytes. Nothing in it
+is pickled, so it loads the same no matter how the classes change, as long
+as FORMAT is bumped when the layout of the blob does.
+
+    save.save(world, "savegame.dat")
+    world = save.load("savegame.dat")
+"""
+import marshal
+import os
+import struct
+import threading
+import zlib
+
+from collections import deque
+from entities import pack_entity, unpack_entity
+from floor import EvictedFloor
+from world import World, State, LOG_HISTORY
+
+MAGIC = b"RLSAVE"
+FORMAT = 3
+HEADER = struct.Struct(">6sH")
+
+
+def pack_floor(floor, player):
+    if isinstance(floor, EvictedFloor):
+        return (floor.seed, floor.entities, floor.potions, floor.arrows, floor.seen, floor.walls, floor.left_turn, None)
+    kept = EvictedFloor.of(floor, player)
+    # a live floor can have changed tiles, has an rng mid-sequence and mobs
+    # already awake, keep all of it so the game carries on exactly
+    slot = {e: i for i, e in enumerate(floor.components["entities"])}
+    scheduler = floor.scheduler
+    # sorted, not in heap order: heapify on load can lay the same queue out
+    # differently, and a snapshot has to come out the same for the same world
+    queue = sorted((time, order, slot[e]) for time, order, e in scheduler.queue if e in slot)
+    live = (bytes(floor.grid.data), floor.version, floor.rng.getstate(), (scheduler.now, scheduler.order, queue))
+    return (kept.seed, kept.entities, kept.potions, kept.arrows, kept.seen, kept.walls, kept.left_turn, live)
+
+
+def unpack_floor(state, world):
+    *kept, live = state
+    evicted = EvictedFloor(*kept)
+    if live is None:
+        return evicted
+    grid, version, rng_state, (now, order, queue) = live
+    floor = evicted.rebuild(world, world.grid_w, world.grid_h)
+    floor.grid.data[:] = grid
+    floor.version = version
+    floor.rng.setstate(rng_state)
+    floor.refresh_free()
+    entities = list(floor.components["entities"])
+    floor.scheduler.restore(now, order, [(time, order, entities[i]) for time, order, i in queue])
+    return floor
+
+
+def snapshot(world):
+    """The world as plain data, cheap enough to take every few turns"""
+    return {
+        "grid": (world.grid_w, world.grid_h),
+        "seed": world.seed,
+        "state": world.state.name,
+        "turn": world.turn,
+        "current_floor": world.current_floor,
+        "damage_taken": dict(sorted(world.damage_taken.items())),
+        # events in the log are only formatted now, the save keeps text
+        "log": [str(message) for message in world.log],
+        "log_count": world.log_count,
+        "player": pack_entity(world.player),
+        "floors": [pack_floor(floor, world.player) for floor in world.floors],
+    }
+
+
+def restore(data):
+    world = World(*data["grid"], seed=data["seed"])
+    world.state = State[data["state"]]
+    world.turn = data["turn"]
+    world.damage_taken = data["damage_taken"]
+    world.log = deque(data["log"], maxlen=LOG_HISTORY)
+    world.log_count = data["log_count"]
+    # floors put the player back into their entity lists, so it has to exist first
+    world.player = unpack_entity(data["player"])
+    world.floors = [unpack_floor(state, world) for state in data["floors"]]
+    world.current_floor = data["current_floor"]
+    # the World above started on the floor below its own floor 0
+    world.drop_next_floor()
+    world.pregenerate()
+    world.visible_tiles = set()
+    world.fov_key = None
+    world.calculate_fov()
+    return world
+
+
+def encode(data):
+    return HEADER.pack(MAGIC, FORMAT) + zlib.compress(marshal.dumps(data), 1)
+
+
+def decode(blob):
+    if len(blob) < HEADER.size:
+        raise ValueError("save file is truncated")
+    magic, version = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("not a save file")
+    if version != FORMAT:
+        raise ValueError(f"save file is format {version}, this version reads {FORMAT}")
+    return marshal.loads(zlib.decompress(blob[HEADER.size:]))
+
+
+def write_file(path, blob):
+    # write next to it and swap, a crash mid-write leaves the old save intact
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(blob)
+    os.replace(tmp, path)
+
+
+def save(world, path):
+    write_file(path, encode(snapshot(world)))
+
+
+def load(path):
+    with open(path, "rb") as f:
+        return restore(decode(f.read()))
+
+
+class Autosaver:
+    """Saves every `every` turns without holding up the game.
+
+    The snapshot is taken on the caller's thread (it has to see a consistent
+    world), compressing and writing happen on a background thread. If the
+    previous write is still going it tries again next turn.
+    """
+
+    def __init__(self, path, every):
+        self.path = path
+        self.every = every
+        self.last_turn = 0
+        self.thread = None
+
+    def tick(self, world):
+        # abs: a restart puts the turn counter back to 0
+        if not self.every or abs(world.turn - self.last_turn) < self.every:
+            return
+        if self.thread and self.thread.is_alive():
+            return
+        self.last_turn = world.turn
+        data = snapshot(world)
+        self.thread = threading.Thread(target=lambda: write_file(self.path, encode(data)), daemon=True)
+        self.thread.start()
+
+    def wait(self):
+        if self.thread:
+            self.thread.join()
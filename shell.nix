@@ -4,6 +4,7 @@ pkgs.mkShell {
   packages = with pkgs; [
     python312
     python312Packages.pygame
+    python312Packages.numpy
     python312Packages.python-lsp-ruff
   ];
 }
@@ -0,0 +1,152 @@
+"""Plays lots of seeded headless games in parallel and collects balance numbers.
+
+    python simulate.py --games 10000 --policy simulate:StairDiver --out runs.json.gz
+
+Every game is seeded from --seed, so a run can be repeated exactly. A policy
+is any "module:name" that builds a callable taking the World and returning an
+Action, it is looked up again inside each worker process.
+
+Results are written column by column (one list per stat, one entry per game)
+as gzipped json, and a short summary is printed.
+"""
+import argparse
+import gzip
+import importlib
+import json
+import multiprocessing
+import random
+import time
+
+from entities import FlowField
+from world import World, State, Action, MOVES
+
+# every mob type create_mob knows about, plus the traps
+DAMAGE_SOURCES = ["orc", "snake", "rat", "amoeba", "arrow trap"]
+
+
+class RandomWalk:
+    """Stumbles around, takes the stairs down when it happens to stand on them"""
+
+    def __call__(self, world):
+        if world.map.grid[world.player.y][world.player.x] == ">":
+            return Action.DESCEND
+        return random.choice(list(MOVES))
+
+
+class StairDiver:
+    """Heads straight for the down stairs and fights whatever is in the way"""
+
+    def __init__(self):
+        self.floor = None
+        self.flow = None
+
+    def __call__(self, world):
+        player = world.player
+        if world.map.grid[player.y][player.x] == ">":
+            return Action.DESCEND
+        if self.floor is not world.map:
+            self.floor = world.map
+            self.flow = FlowField(world.map, *world.map.find_down_stairs(world.map.grid))
+        step = self.flow.step_toward(player.x, player.y)
+        for action, move in MOVES.items():
+            if move == step:
+                return action
+        return random.choice(list(MOVES))
+
+
+def count_amoebas(world):
+    return sum(1 for e in world.map.components["entities"] if e.name == "amoeba")
+
+
+def load_policy(path):
+    module, name = path.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def play(job):
+    """Plays one game to the end (or max_turns), returns its stats as a dict"""
+    seed, policy_path, max_turns = job
+    random.seed(seed)
+    policy = load_policy(policy_path)()
+    world = World(seed=seed)
+
+    amoeba_start = amoeba_peak = count_amoebas(world)
+    deepest = 0
+
+    while world.state == State.OVERWORLD and world.turn < max_turns:
+        floor = world.current_floor
+        world.step(policy(world))
+        if world.current_floor != floor:
+            deepest = max(deepest, world.current_floor)
+            amoeba_start = amoeba_peak = count_amoebas(world)
+        else:
+            amoeba_peak = max(amoeba_peak, count_amoebas(world))
+
+    row = {
+        "seed": seed,
+        "died": int(world.state == State.GAMEOVER),
+        "floor": world.current_floor,
+        "deepest": deepest,
+        "turns": world.turn,
+        "level": world.player.level,
+        "score": world.player.score,
+        # amoebas on the last floor played, when it was entered and at the most
+        "amoeba_start": amoeba_start,
+        "amoeba_peak": amoeba_peak,
+    }
+    for source in DAMAGE_SOURCES:
+        row["damage_" + source.replace(" ", "_")] = world.damage_taken.get(source, 0)
+    return row
+
+
+def to_columns(rows):
+    return {key: [row[key] for row in rows] for key in rows[0]}
+
+
+def summarize(columns):
+    games = len(columns["seed"])
+
+    def mean(key):
+        return sum(columns[key]) / games
+
+    print(f"games: {games}  died: {sum(columns['died'])}")
+    print(f"turns survived: {mean('turns'):.1f}  deepest floor: {mean('deepest'):.2f}  level: {mean('level'):.2f}")
+    deaths = {}
+    for died, floor in zip(columns["died"], columns["floor"]):
+        if died:
+            deaths[floor] = deaths.get(floor, 0) + 1
+    print("deaths by floor: " + " ".join(f"{floor}:{count}" for floor, count in sorted(deaths.items())))
+    print("mean damage taken: " + " ".join(f"{source}:{mean('damage_' + source.replace(' ', '_')):.1f}" for source in DAMAGE_SOURCES))
+    print(f"amoebas on last floor: {mean('amoeba_start'):.1f} -> peak {mean('amoeba_peak'):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0, help="first game's seed, the rest count up from it")
+    parser.add_argument("--policy", default="simulate:StairDiver")
+    parser.add_argument("--max-turns", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--out", default="simulation.json.gz")
+    args = parser.parse_args()
+
+    # fail here instead of in every worker
+    load_policy(args.policy)
+
+    jobs = [(args.seed + i, args.policy, args.max_turns) for i in range(args.games)]
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.workers) as pool:
+        rows = list(pool.imap_unordered(play, jobs, chunksize=max(1, args.games // (args.workers * 8))))
+    elapsed = time.perf_counter() - start
+    rows.sort(key=lambda row: row["seed"])
+
+    columns = to_columns(rows)
+    with gzip.open(args.out, "wt") as f:
+        json.dump({"policy": args.policy, "max_turns": args.max_turns, "columns": columns}, f, separators=(",", ":"))
+
+    summarize(columns)
+    print(f"{args.games} games in {elapsed:.1f}s on {args.workers} workers, written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the bulk helpers fall back to plain python
+    np = None
+
+# tile ids are just the ascii code of the symbol, so a grid is one byte per tile
+WALL = ord("#")
+FLOOR = ord(".")
+UP_STAIRS = ord("<")
+DOWN_STAIRS = ord(">")
+
+# lookup tables indexed by tile id
+PASSABLE = bytes(0 if i == WALL else 1 for i in range(256))
+BLOCKS_SIGHT = bytes(1 if i == WALL else 0 for i in range(256))
+
+
+class TileRow:
+    """One row of a TileGrid, so `grid[y][x]` keeps working and reads a 1-char string"""
+
+    __slots__ = ("data", "start", "width")
+
+    def __init__(self, data, start, width):
+        self.data = data
+        self.start = start
+        self.width = width
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self.width
+        return chr(self.data[self.start + x])
+
+    def __setitem__(self, x, ch):
+        if x < 0:
+            x += self.width
+        self.data[self.start + x] = ord(ch)
+
+    def __len__(self):
+        return self.width
+
+    def __iter__(self):
+        return iter(self.data[self.start:self.start + self.width].decode("ascii"))
+
+
+class TileGrid:
+    """Compact map storage: a bytearray of tile ids, row by row.
+
+    Old style `grid[y][x]` reads and writes still work. Hot paths should use
+    `tile`, `passable` and `blocks_sight` which skip the row object, and
+    `open_tiles` runs as an array operation when numpy is around.
+    """
+
+    def __init__(self, width, height, fill="#"):
+        self.width = width
+        self.height = height
+        self.data = bytearray([ord(fill)]) * (width * height)
+
+    def __getitem__(self, y):
+        if y < 0:
+            y += self.height
+        return TileRow(self.data, y * self.width, self.width)
+
+    def __len__(self):
+        return self.height
+
+    def __iter__(self):
+        for y in range(self.height):
+            yield TileRow(self.data, y * self.width, self.width)
+
+    def tile(self, x, y):
+        return chr(self.data[y * self.width + x])
+
+    def set(self, x, y, ch):
+        self.data[y * self.width + x] = ord(ch)
+
+    def passable(self, x, y):
+        return PASSABLE[self.data[y * self.width + x]] == 1
+
+    def blocks_sight(self, x, y):
+        return BLOCKS_SIGHT[self.data[y * self.width + x]] == 1
+
+    # carving, each of these is a slice assignment per row (or one strided
+    # slice for a column) instead of a python loop per tile
+
+    def fill_rect(self, x, y, w, h, ch):
+        row = bytes([ord(ch)]) * w
+        for yy in range(y, y + h):
+            start = yy * self.width + x
+            self.data[start:start + w] = row
+
+    def hline(self, x1, x2, y, ch):
+        x1, x2 = min(x1, x2), max(x1, x2)
+        start = y * self.width
+        self.data[start + x1:start + x2 + 1] = bytes([ord(ch)]) * (x2 - x1 + 1)
+
+    def vline(self, x, y1, y2, ch):
+        y1, y2 = min(y1, y2), max(y1, y2)
+        w = self.width
+        self.data[y1 * w + x:y2 * w + x + 1:w] = bytes([ord(ch)]) * (y2 - y1 + 1)
+
+    def rect_has(self, x, y, w, h, ch):
+        """True if any tile in the rectangle is ch"""
+        t = ord(ch)
+        for yy in range(y, y + h):
+            start = yy * self.width + x
+            if t in self.data[start:start + w]:
+                return True
+        return False
+
+    def flood(self, x, y):
+        """bytearray with a 1 for every tile reachable from (x, y) over passable tiles"""
+        w, data = self.width, self.data
+        size = len(data)
+        seen = bytearray(size)
+        start = y * w + x
+        seen[start] = 1
+        stack = [start]
+        pop, push = stack.pop, stack.append
+        while stack:
+            i = pop()
+            col = i % w
+            if col > 0 and not seen[i - 1] and PASSABLE[data[i - 1]]:
+                seen[i - 1] = 1
+                push(i - 1)
+            if col < w - 1 and not seen[i + 1] and PASSABLE[data[i + 1]]:
+                seen[i + 1] = 1
+                push(i + 1)
+            if i >= w and not seen[i - w] and PASSABLE[data[i - w]]:
+                seen[i - w] = 1
+                push(i - w)
+            if i + w < size and not seen[i + w] and PASSABLE[data[i + w]]:
+                seen[i + w] = 1
+                push(i + w)
+        return seen
+
+    def array(self):
+        """(height, width) uint8 view sharing memory with the grid, needs numpy"""
+        return np.frombuffer(self.data, dtype=np.uint8).reshape(self.height, self.width)
+
+    def open_tiles(self):
+        """(x, y) of every plain floor tile"""
+        if np is not None:
+            idx = np.flatnonzero(self.array() == FLOOR)
+            return list(zip((idx % self.width).tolist(), (idx // self.width).tolist()))
+        w = self.width
+        return [(i % w, i // w) for i, t in enumerate(self.data) if t == FLOOR]
@@ -0,0 +1,242 @@
+import random
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum, auto
+from entities import Entity, Weapon
+from events import EventBus, Event, Attack, ArrowHit
+from floor import Floor, EvictedFloor
+from fov import compute_fov
+
+
+GRID_W = 40
+GRID_H = 20
+LOG_HISTORY = 500
+
+# builds the floor below the player while they play this one, see World.pregenerate
+FLOOR_BUILDER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="floorgen")
+
+
+class State(Enum):
+    GAMEOVER = auto()
+    OVERWORLD = auto()
+
+
+class Action(Enum):
+    UP = auto()
+    DOWN = auto()
+    LEFT = auto()
+    RIGHT = auto()
+    DESCEND = auto()
+    ASCEND = auto()
+    RESTART = auto()
+
+
+# (dx, dy) for the movement actions
+MOVES = {
+    Action.UP: (0, -1),
+    Action.DOWN: (0, 1),
+    Action.LEFT: (-1, 0),
+    Action.RIGHT: (1, 0),
+}
+
+
+class World:
+    """The whole game simulation, no pygame involved.
+
+    Drive it with `step(action)`, a front end (game.py, a bot, a benchmark)
+    reads the state back out to draw or decide.
+    """
+
+    def __init__(self, grid_w=GRID_W, grid_h=GRID_H, seed=None, pregenerate=True):
+        self.grid_w = grid_w
+        self.grid_h = grid_h
+        self.vision_radius = 8  # Vision range
+        self.pregenerate_floors = pregenerate
+        # what happens in a turn is emitted here and handed out once it's
+        # over, the log and damage stats are just two of the subscribers
+        self.events = EventBus()
+        self.events.subscribe(Event, self.log_message)
+        self.events.subscribe(Attack, self.record_damage)
+        self.events.subscribe(ArrowHit, self.record_damage)
+        # (seed, depth, future) of the floor being built ahead of time, and a
+        # build nobody wants any more that was already running when dropped
+        self.next_floor = None
+        self.stale_build = None
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        self.state = State.OVERWORLD
+        # every floor is generated from this plus its depth, see floor_seed
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self.player = Entity("player", 5, 5, 100, 5, (0, 255, 0), "@", Weapon("Sword", 30, "!", 5, 10))
+        # a floor more than one flight of stairs away is swapped for an
+        # EvictedFloor and rebuilt from its seed when the player comes back
+        self.floors = [Floor(self, self.grid_w, self.grid_h, self.floor_seed(0))]
+        self.current_floor = 0
+        self.turn = 0
+        # damage the player took, by what dealt it
+        self.damage_taken = {}
+        self.map.populate(0)
+        self.events.clear()
+        self.log = deque(maxlen=LOG_HISTORY)
+        # every message ever logged, the log itself only keeps the last LOG_HISTORY
+        self.log_count = 0
+        self.map.add_component("entities", self.player)
+
+        # Fog of war system
+        self.visible_tiles = set()  # Tiles currently visible
+        self.fov_key = None
+        self.calculate_fov()
+
+        self.drop_next_floor()
+        self.pregenerate()
+
+    def floor_seed(self, depth):
+        return f"{self.seed}:{depth}"
+
+    @property
+    def map(self):
+        return self.floors[self.current_floor]
+
+    @property
+    def seen_tiles(self):
+        # every floor keeps its own explored map, so nothing to stash on stairs
+        return self.map.explored
+
+    def go_down_stairs(self):
+        if self.current_floor == len(self.floors) - 1:
+            new_floor = self.take_next_floor()
+            new_floor.add_component("entities", self.player)
+            self.floors.append(new_floor)
+
+        self.change_floor(self.current_floor + 1)
+        self.map.place(self.player, *self.map.find_up_stairs(self.map.grid))
+        # Reset fog of war for new floor
+        self.visible_tiles = set()
+        self.calculate_fov()
+
+    def go_up_stairs(self):
+        self.change_floor(self.current_floor - 1)
+        self.map.place(self.player, *self.map.find_down_stairs(self.map.grid))
+        # Reset fog of war for new floor
+        self.visible_tiles = set()
+        self.calculate_fov()
+
+    def build_floor(self, depth):
+        floor = Floor(self, self.grid_w, self.grid_h, self.floor_seed(depth))
+        floor.populate(depth)
+        return floor
+
+    def pregenerate(self):
+        """Starts building the next new floor in the background once the
+        player is on the deepest one, floors only depend on their seed so it
+        comes out the same as building it on the stairs"""
+        depth = len(self.floors)
+        if not self.pregenerate_floors or self.current_floor != depth - 1:
+            return
+        if self.next_floor and self.next_floor[:2] == (self.seed, depth):
+            return
+        self.drop_next_floor()
+        if self.stale_build and not self.stale_build.done():
+            # don't queue behind it, the stairs build the floor themselves if need be
+            return
+        self.next_floor = (self.seed, depth, FLOOR_BUILDER.submit(self.build_floor, depth))
+
+    def drop_next_floor(self):
+        """Forgets the floor being built ahead, cancelling it if it hasn't started"""
+        if self.next_floor and not self.next_floor[2].cancel():
+            self.stale_build = self.next_floor[2]
+        self.next_floor = None
+
+    def take_next_floor(self):
+        depth = len(self.floors)
+        if self.next_floor and self.next_floor[:2] == (self.seed, depth):
+            # waits if it isn't quite done yet
+            floor = self.next_floor[2].result()
+        else:
+            floor = self.build_floor(depth)
+        self.next_floor = None
+        return floor
+
+    def change_floor(self, depth):
+        """Makes depth the current floor, rebuilding it if it was evicted,
+        catching it up on the turns it missed and evicting whatever is now out
+        of reach"""
+        self.map.left_turn = self.turn
+        if isinstance(self.floors[depth], EvictedFloor):
+            self.floors[depth] = self.floors[depth].rebuild(self, self.grid_w, self.grid_h)
+        self.current_floor = depth
+        if self.map.left_turn is not None:
+            # it kept going while the player was away, roughly
+            self.map.catch_up(self.turn - self.map.left_turn)
+            self.map.left_turn = None
+        for i, floor in enumerate(self.floors):
+            # the floors right above and below stay live, the player can step
+            # back and forth on the stairs without paying for a rebuild each time.
+            # a floor whose walls changed can't come back from its seed
+            if abs(i - depth) > 1 and isinstance(floor, Floor) and floor.version == 0:
+                self.floors[i] = EvictedFloor.of(floor, self.player)
+        self.pregenerate()
+
+    # the log keeps the last LOG_HISTORY messages, older ones fall off the
+    # front of the deque on their own. a message is a string or an Event, which
+    # only gets turned into text (str) when it's shown
+    def log_message(self, message):
+        self.log.append(message)
+        self.log_count += 1
+
+    def record_damage(self, event):
+        if event.target is self.player:
+            self.damage_taken[event.source] = self.damage_taken.get(event.source, 0) + event.damage
+
+    def calculate_fov(self):
+        """Calculate field of view using shadowcasting - walls block vision"""
+        # only recompute when the player moved, changed floor or the map's walls changed
+        key = (self.player.x, self.player.y, self.map, self.map.version, self.vision_radius)
+        if key == self.fov_key:
+            return
+        self.fov_key = key
+
+        grid = self.map.grid
+        # using (y, x) format for consistency
+        self.visible_tiles = compute_fov(grid.blocks_sight, grid.width, grid.height, self.player.x, self.player.y, self.vision_radius)
+        self.map.explored.reveal(self.visible_tiles, grid)
+
+    def update(self):
+        self.map.update()
+        self.turn += 1
+        self.events.dispatch()
+
+        # Calculate field of view
+        self.calculate_fov()
+
+        if self.player.health <= 0:
+            self.state = State.GAMEOVER
+
+    def step(self, action):
+        """Apply one player action, returns True if it used up a turn"""
+        match self.state:
+            case State.OVERWORLD:
+                if action in MOVES:
+                    self.map.move_entity(self.player, *MOVES[action])
+                    self.update()
+                    return True
+
+                match action:
+                    case Action.DESCEND:
+                        if self.map.grid[self.player.y][self.player.x] == ">":
+                            self.go_down_stairs()
+
+                    case Action.ASCEND:
+                        if self.current_floor > 0 and self.map.grid[self.player.y][self.player.x] == "<":
+                            self.go_up_stairs()
+
+                    case Action.RESTART:
+                        self.reset()
+
+            case State.GAMEOVER:
+                if action == Action.RESTART:
+                    self.reset()
+
+        return False